@@ -1,6 +1,7 @@
+import math
 from math import pi
 import numpy as np
-from typing import List
+from typing import List, Optional, Tuple
 
 from arena.obstacle import Obstacle
 from common.consts import (
@@ -20,14 +21,88 @@ from common.consts import (
     BR_Y_BOUND,
     DIST_FW,
     DIST_BW,
-    BUFFER
+    BUFFER,
+    OBSTACLE_BUCKET_SIZE,
+    LATTICE_THETA,
+    LATTICE_X,
+    LATTICE_Y,
+    SNAP_COORD,
+    SNAP_THETA,
+    WPS_BL,
+    WPS_BR,
+    WPS_FL,
+    WPS_FR
 )
 from common.enums import Movement
 from common.types import Position
 from common.enums import Movement
 from common.utils import calc_vector
+from robot.move import MOTIONS, heading_to_theta
 
 
+
+# The robot's footprint, spanned from its btm left corner by its front and right unit vectors (ux, uy) and (uy, -ux)
+_R_LEN_UP = ROBOT_HEIGHT + 8
+_R_LEN_RIGHT = ROBOT_WIDTH + 8
+# Half extent of the obstacles' virtual boundaries, around their middle (in cm)
+EXTRA_VIRTUAL_BOUNDARY = 15
+_HALF_BOUNDARY = OBSTACLE_WIDTH / 2 - EDGE_ERR + EXTRA_VIRTUAL_BOUNDARY
+
+
+def _compute_boxes(theta: float, bounds: dict) -> dict:
+    """Offsets (x lo, x hi, y lo, y hi) from the robot facing `theta` of the axis-aligned box spanned by the top left
+    and bottom right corners of the `bounds` of every movement (see `Map.bounds`)"""
+    v_t = calc_vector(theta, 1)
+    v_r = calc_vector(theta - pi/2, 1)
+    boxes = {}
+    for move, (left, right, front, back) in bounds.items():
+        tl = v_t*front - v_r*left
+        br = v_r*right - v_t*back
+        boxes[move] = (
+            float(min(tl[0], br[0])), float(max(tl[0], br[0])), float(min(tl[1], br[1])), float(max(tl[1], br[1]))
+        )
+    return boxes
+
+
+def _lattice_boxes(bounds: dict) -> List[dict]:
+    return [_compute_boxes(heading_to_theta(heading), bounds) for heading in range(LATTICE_THETA)]
+
+
+# The separating-axis test of `Map.is_valid_batch`, in plain arithmetic so that it runs on numpy arrays (many poses
+# and obstacles at once) as well as on floats (`Map._is_clear`)
+def _robot_extent(x, y, ux, uy):
+    """Axis-aligned extent (min x, max x, min y, max y) of the robot at (x, y) facing (ux, uy)"""
+    fx, fy, rx, ry = ux * _R_LEN_UP, uy * _R_LEN_UP, uy * _R_LEN_RIGHT, -ux * _R_LEN_RIGHT
+    # min(0, v) is (v - |v|) / 2 and max(0, v) is (v + |v|) / 2
+    return (
+        x + (fx - abs(fx)) / 2 + (rx - abs(rx)) / 2,
+        x + (fx + abs(fx)) / 2 + (rx + abs(rx)) / 2,
+        y + (fy - abs(fy)) / 2 + (ry - abs(ry)) / 2,
+        y + (fy + abs(fy)) / 2 + (ry + abs(ry)) / 2
+    )
+
+
+def _within_map(extent, margin: float = 0):
+    """Whether the robot of axis-aligned `extent` is within the Map shrunk by `margin`"""
+    min_x, max_x, min_y, max_y = extent
+    return (
+        (margin - EDGE_ERR <= min_x) & (max_x <= MAP_WIDTH + EDGE_ERR - margin) &
+        (margin - EDGE_ERR <= min_y) & (max_y <= MAP_HEIGHT + EDGE_ERR - margin)
+    )
+
+
+def _separated(x, y, ux, uy, extent, o_cx, o_cy, half):
+    """Whether the robot at (x, y) facing (ux, uy), of axis-aligned `extent`, is clear of the square of middle
+    (o_cx, o_cy) and half extent `half`: some axis of the world frame or of the robot's frame separates them"""
+    min_x, max_x, min_y, max_y = extent
+    separated = (max_x < o_cx - half) | (o_cx + half < min_x) | (max_y < o_cy - half) | (o_cy + half < min_y)
+    # Separating axes of the robot frame: project the square's middle and half extent
+    for ax, ay, length in ((ux, uy, _R_LEN_UP), (uy, -ux, _R_LEN_RIGHT)):
+        c = (o_cx - x) * ax + (o_cy - y) * ay
+        reach = half * (abs(ax) + abs(ay))
+        separated = separated | (c + reach < 0) | (length < c - reach)
+    return separated
+
 class Map:
     bounds = {
         Movement.FWD: [
@@ -48,8 +123,29 @@ class Map:
         Movement.BWD_RIGHT: BR_X_BOUND + BR_Y_BOUND
     }
 
+    # Poses (right, front, heading change) relative to the start pose that must be valid for a move to be
+    # collision-free; mirrors `has_collision` in `path_finding/path_validation.py`
+    waypoints = {
+        Movement.FWD: [(0, DIST_FW, 0)],
+        Movement.BWD: [(0, -DIST_FW, 0)],
+        Movement.FWD_LEFT: WPS_FL,
+        Movement.FWD_RIGHT: WPS_FR,
+        Movement.BWD_LEFT: WPS_BL,
+        Movement.BWD_RIGHT: WPS_BR
+    }
+
+    # Boxes of the bounds of every movement for every lattice heading (see `_boxes()`)
+    heading_boxes = _lattice_boxes(bounds)
+
     def __init__(self, obstacles: List["Obstacle"]):
         self.obstacles = obstacles
+        self._valid_moves = None
+        self._cell_valid_moves = None
+
+        # Uniform grid index of the obstacles' middles: (bucket x, bucket y) -> obstacles
+        self.buckets = {}
+        for o in obstacles:
+            self.buckets.setdefault(self._bucket(*o.middle), []).append(o)
 
     def _within_bounds(self, x: float, y: float) -> bool:
         """Checks if (x, y) is within the boundary of the Map"""
@@ -58,81 +154,150 @@ class Map:
             and -EDGE_ERR <= y <= MAP_HEIGHT + EDGE_ERR
         )
 
-    def is_valid(self, pos: Position, obstacles: List["Obstacle"]) -> bool:
-        # Robot
-        r_origin = np.array([pos.x, pos.y])
-        r_vec_up = calc_vector(pos.theta, ROBOT_HEIGHT + 8)
-        r_vec_right = calc_vector(
-            pos.theta - pi / 2, ROBOT_WIDTH + 8
-        )
+    def is_valid(self, pos: Position, obstacles: Optional[List["Obstacle"]] = None) -> bool:
+        """Checks if the robot at `pos` is within the Map and clear of `obstacles` (defaults to every obstacle)"""
+        return bool(self.is_valid_batch(np.array([[pos.x, pos.y, pos.theta]]), obstacles)[0])
+
+    def is_valid_batch(
+        self,
+        poses: np.ndarray,
+        obstacles: Optional[List["Obstacle"]] = None,
+        checked: Optional[np.ndarray] = None,
+        margin: float = 0
+    ) -> np.ndarray:
+        """Batch version of `is_valid`
+
+        Tests every pose against every obstacle at once with a separating-axis test between the robot's
+        (rotated) footprint and the obstacles' axis-aligned virtual boundaries.
+
+        Args:
+            poses (np.ndarray) : (N, 3) array of robot poses (x, y, theta)
+            obstacles (List[Obstacle]) : Obstacles to check against. Defaults to every obstacle of the Map
+            checked (np.ndarray) : Optional (N, len(obstacles)) boolean mask of the obstacles each pose is checked against
+            margin (float) : A pose is only valid if every pose shifted by up to `margin` along each axis (same
+                heading) is, by inflating the obstacles and shrinking the Map by `margin`. A negative margin makes it
+                valid if some shifted pose is instead
+
+        Returns:
+            np.ndarray : (N,) boolean mask of the valid poses
+        """
+        if obstacles is None:
+            obstacles = self.obstacles
+        poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+        x, y, theta = poses[:, 0:1], poses[:, 1:2], poses[:, 2:3]
+
+        ux, uy = np.cos(theta), np.sin(theta)  # unit vector to the front
+        extent = _robot_extent(x, y, ux, uy)
 
         # Check if Robot is within the bound of the map
-        if not (
-            self._within_bounds(*r_origin)
-            and self._within_bounds(*(r_origin + r_vec_up))
-            and self._within_bounds(*(r_origin + r_vec_right))
-            and self._within_bounds(*(r_origin + r_vec_right + r_vec_up))
-        ):
-            return False
-
-        # Robot Segments / Edges
-        r_segments = [
-            (r_origin, r_origin + r_vec_up),  # left edge
-            (r_origin, r_origin + r_vec_right),  # btm edge
-            (r_origin + r_vec_up, r_origin + r_vec_up + r_vec_right),  # top edge
-            (r_origin + r_vec_right, r_origin +
-             r_vec_right + r_vec_up),  # right edge
-        ]
+        valid = _within_map(extent, margin)[:, 0]
+        if not obstacles:
+            return valid
 
-        # Robot Corners
-        r_corners = [
-            r_origin,  # btm left
-            r_origin + r_vec_right,  # btm right
-            r_origin + r_vec_up,  # top left
-            r_origin + r_vec_up + r_vec_right,  # top right
-        ]
+        # Middles of the obstacles, as (1, M) rows
+        o_cx = np.array([[o.middle[0] for o in obstacles]])
+        o_cy = np.array([[o.middle[1] for o in obstacles]])
 
-        # For every obstacle, check if any of the 4 obstacle corners lies within the robot
-        # To increase the virtual boundary of the obstacle (in cm)
-        EXTRA_VIRTUAL_BOUNDARY = 15
-        for obs in obstacles:
-            # Obstacle bounds with virtual boundary
-            o_btm = obs.y + EDGE_ERR - EXTRA_VIRTUAL_BOUNDARY
-            o_left = obs.x + EDGE_ERR - EXTRA_VIRTUAL_BOUNDARY
-            o_top = obs.y + OBSTACLE_WIDTH - EDGE_ERR + EXTRA_VIRTUAL_BOUNDARY
-            o_right = obs.x + OBSTACLE_WIDTH - EDGE_ERR + EXTRA_VIRTUAL_BOUNDARY
-            
-            # Check 1: Robot corners inside obstacle
-            for cx, cy in r_corners:
-                if o_left <= cx <= o_right and o_btm <= cy <= o_top:
-                    return False
-            
-            # Check 2: Obstacle corners inside robot (IMPROVED)
-            obstacle_corners = [
-                np.array([o_left, o_btm]),
-                np.array([o_left, o_top]),
-                np.array([o_right, o_top]),
-                np.array([o_right, o_btm])
-            ]
-            
-            for o_corner in obstacle_corners:
-                if self._point_in_rotated_rect(o_corner, r_origin, r_vec_up, r_vec_right):
-                    return False
-            
-            # Check 3: Edge-to-edge intersection (NEW - CRITICAL)
-            obstacle_edges = [
-                (np.array([o_left, o_btm]), np.array([o_left, o_top])),    # left
-                (np.array([o_left, o_top]), np.array([o_right, o_top])),   # top
-                (np.array([o_right, o_top]), np.array([o_right, o_btm])),  # right
-                (np.array([o_right, o_btm]), np.array([o_left, o_btm]))    # bottom
+        collides = ~_separated(x, y, ux, uy, extent, o_cx, o_cy, _HALF_BOUNDARY + margin)
+        if checked is not None:
+            collides &= checked
+        return valid & ~collides.any(axis=1)
+
+    def valid_moves(self) -> np.ndarray:
+        """
+            Configuration-space cache of the layout: a (LATTICE_X, LATTICE_Y, LATTICE_THETA, len(MOTIONS)) boolean
+            table of whether each motion primitive (see `robot/move.py`) is collision-free from each snapped pose.
+
+            Computed once per obstacle layout (on first use) so that collision checking during the searches
+            becomes a single array index.
+        """
+        if self._valid_moves is None:
+            self._valid_moves = self._compute_valid_moves()
+        return self._valid_moves
+
+    def cell_valid_moves(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+            Bounds of `valid_moves()` for the poses that the primitives' offsets take off the lattice: whether each
+            motion primitive is collision-free from every pose that snaps to the cell (up to half a cell away along
+            each axis, with the cell's heading), and whether it is from some of them. The moves on which they
+            disagree depend on the exact pose, see `valid_moves_at()`.
+        """
+        if self._cell_valid_moves is None:
+            self._cell_valid_moves = (
+                self._compute_valid_moves(margin=SNAP_COORD / 2),
+                self._compute_valid_moves(margin=-SNAP_COORD / 2)
+            )
+        return self._cell_valid_moves
+
+    def valid_moves_at(self, pos: "Position") -> np.ndarray:
+        """
+            Whether each motion primitive is collision-free from the exact pose `pos` (as `has_collision`), as a
+            (len(MOTIONS),) boolean array: the waypoints of every move are checked against the obstacles of
+            `priority_obs`, one pose at a time with the test of `is_valid_batch`, which is cheaper for these few poses
+        """
+        sin, cos = math.sin(pos.theta), math.cos(pos.theta)
+        boxes = self._boxes(pos.theta)
+        # a single lookup in the obstacle index, for the boxes of all the moves
+        near = self._obstacles_in(
+            pos.x + min(box[0] for box in boxes.values()), pos.x + max(box[1] for box in boxes.values()),
+            pos.y + min(box[2] for box in boxes.values()), pos.y + max(box[3] for box in boxes.values())
+        )
+        valid = []
+        for mv, wps in _MOVES:
+            x_lo, x_hi, y_lo, y_hi = boxes[mv]
+            obstacles = [
+                o for o in near
+                if pos.x + x_lo < o.middle[0] < pos.x + x_hi and pos.y + y_lo < o.middle[1] < pos.y + y_hi
             ]
-            
-            for r_seg in r_segments:
-                for o_seg in obstacle_edges:
-                    if self._segments_intersect(r_seg[0], r_seg[1], o_seg[0], o_seg[1]):
-                        return False
-        
-        return True
+            valid.append(all(
+                self._is_clear(pos.x + wr * sin + wf * cos, pos.y - wr * cos + wf * sin, pos.theta + dth, obstacles)
+                for wr, wf, dth in wps
+            ))
+        return np.array(valid)
+
+    @staticmethod
+    def _is_clear(x: float, y: float, theta: float, obstacles: List["Obstacle"]) -> bool:
+        """`is_valid_batch` for a single pose"""
+        ux, uy = math.cos(theta), math.sin(theta)
+        extent = _robot_extent(x, y, ux, uy)
+        return _within_map(extent) and all(
+            _separated(x, y, ux, uy, extent, *o.middle, _HALF_BOUNDARY) for o in obstacles
+        )
+
+    def _compute_valid_moves(self, margin: float = 0) -> np.ndarray:
+        x, y, heading = np.meshgrid(
+            np.arange(LATTICE_X) * SNAP_COORD,
+            np.arange(LATTICE_Y) * SNAP_COORD,
+            np.arange(LATTICE_THETA),
+            indexing='ij'
+        )
+        theta = heading_to_theta(heading)
+        v_r = np.stack([np.cos(theta - pi/2), np.sin(theta - pi/2)])  # unit vector to the right of the robot
+        v_f = np.stack([np.cos(theta), np.sin(theta)])  # unit vector to the front of the robot
+
+        valid = np.ones((LATTICE_X, LATTICE_Y, LATTICE_THETA, len(MOTIONS)), dtype=bool)
+        for k, (_, _, _, mv, *_) in enumerate(MOTIONS):
+            # Same obstacles as `priority_obs`: those whose middle lies in the bounding box of the move (grown or
+            # shrunk by `margin`, as the box moves with the pose)
+            bounds = self.bounds[mv]
+            tl = (x + v_f[0]*bounds[2] - v_r[0]*bounds[0], y + v_f[1]*bounds[2] - v_r[1]*bounds[0])
+            br = (x - v_f[0]*bounds[3] + v_r[0]*bounds[1], y - v_f[1]*bounds[3] + v_r[1]*bounds[1])
+            x_lo, x_hi = np.minimum(tl[0], br[0]) - margin, np.maximum(tl[0], br[0]) + margin
+            y_lo, y_hi = np.minimum(tl[1], br[1]) - margin, np.maximum(tl[1], br[1]) + margin
+            priority = np.zeros(x.shape + (len(self.obstacles),), dtype=bool)
+            for j, o in enumerate(self.obstacles):
+                priority[..., j] = (x_lo < o.middle[0]) & (o.middle[0] < x_hi) & \
+                    (y_lo < o.middle[1]) & (o.middle[1] < y_hi)
+            priority = priority.reshape(x.size, len(self.obstacles))
+
+            for wp in self.waypoints[mv]:
+                poses = np.stack([
+                    x + wp[0] * v_r[0] + wp[1] * v_f[0],
+                    y + wp[0] * v_r[1] + wp[1] * v_f[1],
+                    theta + wp[2]
+                ], axis=-1).reshape(-1, 3)
+                valid[..., k] &= self.is_valid_batch(poses, checked=priority, margin=margin).reshape(x.shape)
+        return valid
 
     def priority_obs(
         self,
@@ -143,31 +308,42 @@ class Map:
             This function helps identify obstacles that are potentially in the path of the robot based on
             its current position and movement direction,
             allowing the robot to prioritize its actions accordingly.
+
+            Candidates are fetched from the buckets of the obstacle index that overlap the movement's bounds.
         """
-        v_t = calc_vector(pos.theta, 1)
-        v_r = calc_vector(pos.theta - pi/2, 1)
-
-        bounds = self.bounds[move]
-        st = np.array([pos.x, pos.y])
-        tl = st + v_t*bounds[2] - v_r*bounds[0]
-        br = st - v_t*bounds[3] + v_r*bounds[1]
-
-        x_bounds = sorted([br[0], tl[0]])
-        y_bounds = sorted([br[1], tl[1]])
-
-        return list(filter(lambda o: x_bounds[0] < o.middle[0] < x_bounds[1] and y_bounds[0] < o.middle[1] < y_bounds[1], self.obstacles))
-    
-    def _point_in_rotated_rect(self, point, origin, vec_up, vec_right):
-        """Check if point is inside rotated rectangle defined by origin and vectors"""
-        v = point - origin
-        # Project onto local axes
-        proj_right = np.dot(v, vec_right) / np.dot(vec_right, vec_right)
-        proj_up = np.dot(v, vec_up) / np.dot(vec_up, vec_up)
-        return 0 <= proj_right <= 1 and 0 <= proj_up <= 1
-
-    def _segments_intersect(self, p1, p2, p3, p4):
-        """Check if line segment p1-p2 intersects with p3-p4"""
-        def ccw(A, B, C):
-            return (C[1]-A[1]) * (B[0]-A[0]) > (B[1]-A[1]) * (C[0]-A[0])
-        
-        return ccw(p1,p3,p4) != ccw(p2,p3,p4) and ccw(p1,p2,p3) != ccw(p1,p2,p4)
\ No newline at end of file
+        x_lo, x_hi, y_lo, y_hi = self._boxes(pos.theta)[move]
+        return self._obstacles_in(pos.x + x_lo, pos.x + x_hi, pos.y + y_lo, pos.y + y_hi)
+
+    def _obstacles_in(self, x_lo: float, x_hi: float, y_lo: float, y_hi: float) -> List["Obstacle"]:
+        """The obstacles whose middle lies strictly within the box, from the buckets of the obstacle index that
+        overlap it (from the occupied buckets if there are fewer of them)"""
+        bx_lo, by_lo = self._bucket(x_lo, y_lo)
+        bx_hi, by_hi = self._bucket(x_hi, y_hi)
+        if (bx_hi - bx_lo + 1) * (by_hi - by_lo + 1) > len(self.buckets):
+            candidates = [
+                bucket for (bx, by), bucket in self.buckets.items() if bx_lo <= bx <= bx_hi and by_lo <= by <= by_hi
+            ]
+        else:
+            candidates = [
+                self.buckets[bx, by] for bx in range(bx_lo, bx_hi + 1) for by in range(by_lo, by_hi + 1)
+                if (bx, by) in self.buckets
+            ]
+        return [
+            o for bucket in candidates for o in bucket if x_lo < o.middle[0] < x_hi and y_lo < o.middle[1] < y_hi
+        ]
+
+    def _bucket(self, x: float, y: float) -> Tuple[int, int]:
+        return int(x // OBSTACLE_BUCKET_SIZE), int(y // OBSTACLE_BUCKET_SIZE)
+
+    @classmethod
+    def _boxes(cls, theta: float) -> dict:
+        """Boxes of the bounds of every movement from the robot facing `theta` (see `_compute_boxes()`), precomputed
+        for the lattice headings"""
+        heading = int(round(theta % (2*pi) / pi * 180 / SNAP_THETA)) % LATTICE_THETA
+        if heading_to_theta(heading) == theta:
+            return cls.heading_boxes[heading]
+        return _compute_boxes(theta, cls.bounds)
+
+
+# Movement and waypoints (see `Map.waypoints`) of every motion code, for `Map.valid_moves_at`
+_MOVES = tuple((mv, tuple(Map.waypoints[mv])) for _, _, _, mv, *_ in MOTIONS)
@@ -183,6 +183,9 @@ CONE = [10, 10, 4, 40]
 # +--------------------+
 """For identifying obstacles that are potentially in the path of the robot"""
 
+# Side (in cm) of the square buckets of the uniform grid used to index obstacles by their middle
+OBSTACLE_BUCKET_SIZE = 40
+
 # *_X = LEFT, RIGHT
 # *_Y = UP, DOWN
 
@@ -249,6 +252,11 @@ GRID_WIDTH = 5  # for display on simulator
 SNAP_COORD = _DIST_STR
 SNAP_THETA = 15  # for cell snap (theta) 45
 
+# number of snapped cells along each axis of the (x, y, theta) search lattice
+LATTICE_X = MAP_WIDTH // SNAP_COORD + 1
+LATTICE_Y = MAP_HEIGHT // SNAP_COORD + 1
+LATTICE_THETA = 360 // SNAP_THETA
+
 # +-----------------+
 # | robot movements |
 # +-----------------+
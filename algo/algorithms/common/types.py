@@ -3,6 +3,7 @@ import numpy as np
 from typing import Tuple
 
 from common.consts import (
+    LATTICE_THETA,
     SNAP_COORD,
     SNAP_THETA
 )
@@ -50,5 +51,14 @@ class Position:
         return self.x, self.y, self.theta
 
 
+    def to_lattice(self) -> Tuple[int, int, int]:
+        """Index of the snapped cell containing this position in the (x, y, theta) search lattice"""
+        x = int(round(self.x / SNAP_COORD))
+        y = int(round(self.y / SNAP_COORD))
+        theta = int(round(self.theta % (2*pi) / pi * 180 / SNAP_THETA)) % LATTICE_THETA
+
+        return x, y, theta
+
+
     def __str__(self) -> str:
         return f'(x:{self.x:6.2f}, y:{self.y:6.2f}, θ:{self.theta:6.2f})'
\ No newline at end of file
@@ -1,23 +1,43 @@
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from typing import Optional
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional, Union
 from enum import Enum
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from arena.map import Map
 from arena.obstacle import Obstacle
 
-from common.consts import SNAP_COORD
+from common.consts import INDOOR, SNAP_COORD
 from common.types import Position
 from common.utils import _mappings as Int_to_Direction_mappings
 
 from math import pi
 
-from path_finding.hamiltonian_path import HamiltonianSearch, AlgoType
+from path_finding.astar import SearchTimeout
+from path_finding.hamiltonian_path import HamiltonianSearch, AlgoType, SearchCancelled, SearchPool
 
-from robot.stm_commands import convert_segments_to_commands
+from robot.stm_commands import convert_segments_to_commands, convertThetatoNumericDirection
 
+import asyncio
+import copy
+import math
 import multiprocessing as mp
+import os
+import threading
 import time
+import uuid
+
+# Planning requests run at once (on threads, sharing the app's `SearchPool`) and planning requests waiting for one
+# of them, beyond which requests are turned down with a 503
+PLANNING_WORKERS = int(os.environ.get("PLANNING_WORKERS", 2))
+PLANNING_QUEUE = int(os.environ.get("PLANNING_QUEUE", 8))
+SEARCH_WORKERS = int(os.environ.get("SEARCH_WORKERS", os.cpu_count() or 1))  # processes of the app's `SearchPool`
+JOBS_KEPT = 100  # finished jobs kept for `GET /jobs/{job_id}`, the oldest are forgotten first
+PLAN_CACHE_SIZE = int(os.environ.get("PLAN_CACHE_SIZE", 64))  # plans kept by `PlanCache`, the least recently used go first
 
 """ -------------------------------------- """
 """ ---------- Endpoint Schemas ---------- """
@@ -52,6 +72,8 @@ class AlgoInput(BaseModel):
     value: AlgoInputValue
     server_mode: Optional[AlgoInputMode] = AlgoInputMode.LIVE
     algo_type: Optional[AlgoType] = AlgoType.EXHAUSTIVE_ASTAR
+    time_budget: Optional[float] = None  # in seconds; if given, the best plan found within it is returned (504 if none)
+    epsilon: Optional[float] = Field(default=None, ge=1)  # weighted A*: trades up to this factor of cost for speed
 
 # Output
 
@@ -65,6 +87,9 @@ class AlgoOutputSimulatorPosition(BaseModel):
 class AlgoOutputSimulator(BaseModel):
     positions: list[AlgoOutputSimulatorPosition]
     runtime: str
+    dropped_obstacles: list[int] = []  # ids of the obstacles left out as unreachable
+    suboptimality_bound: Optional[float] = None  # the plan costs at most this many times the lowest cost
+    cache_hit: bool = False  # the plan of an earlier request of the same layout (see `PlanCache`)
 
 
 class AlgoOutputLivePosition(BaseModel):
@@ -81,6 +106,18 @@ class AlgoOutputLiveCommand(BaseModel):
 
 class AlgoOutputLive(BaseModel):
     commands: list[AlgoOutputLiveCommand]
+    dropped_obstacles: list[int] = []  # ids of the obstacles left out as unreachable
+    suboptimality_bound: Optional[float] = None  # the plan costs at most this many times the lowest cost
+    cache_hit: bool = False  # the plan of an earlier request of the same layout (see `PlanCache`)
+    runtime: Optional[str] = None
+
+
+class AlgoOutputLiveBatch(BaseModel):
+    commands: list[AlgoOutputLiveCommand]  # the commands of a leg, ending with the SNAP of its obstacle
+
+
+class AlgoOutputError(BaseModel):
+    detail: str
 
 
 class AlgoPositionhNew(BaseModel):
@@ -94,6 +131,20 @@ class AlgoOutputLiveResponseNew(BaseModel):
     path: list[AlgoPositionhNew]  # return path
 
 
+class JobProgress(BaseModel):
+    edges_done: int  # edges of the current pass found
+    edges_total: int  # edges of the current pass
+    best_cost: Optional[float] = None  # cost of the best plan so far
+
+
+class JobOutput(BaseModel):
+    job_id: str
+    status: str  # "queued" | "running" | "done" | "failed" | "cancelled"
+    progress: Optional[JobProgress] = None  # once running
+    result: Optional[Union[AlgoOutputSimulator, AlgoOutputLive]] = None  # once done
+    error: Optional[str] = None  # once failed
+
+
 class ImageDetectionResponse(BaseModel):
     detection_status: str = "Objects detected"
     objects: list[str]
@@ -106,7 +157,13 @@ if __name__ == '__main__':
     mp.freeze_support()  # Needed to run child processes (multiprocessing)
 
 
-def main(algo_input: AlgoInput, include_both: bool = False):
+def main(algo_input: AlgoInput, include_both: bool = False, pool: Optional[SearchPool] = None,
+         received: Optional[float] = None, on_start: Optional[Callable[[HamiltonianSearch], None]] = None,
+         on_leg: Optional[Callable[[list[AlgoOutputLiveCommand]], None]] = None):
+    # Deadline of the search, counted from the start of the request (`received`, if it waited to be planned)
+    time_budget = algo_input.get("time_budget")
+    deadline = (received or time.time()) + time_budget if time_budget is not None else None
+
     # Algorithm Server Mode -> 'simulator' or 'live'
     algo_server_mode = algo_input["server_mode"]
 
@@ -118,16 +175,8 @@ def main(algo_input: AlgoInput, include_both: bool = False):
         algo_input["value"]["obstacles"], algo_server_mode)
 
         # Start Position
-    # start_position = Position(x=0, y=0, theta=pi/2)
-    initial_position = algo_input["value"].get("initial_position", None)
-    print("Initial position from input:", initial_position)
-    if initial_position is None:
-        start_x, start_y, start_theta = 0, 0, 1.57
-    else:
-        start_x = initial_position.get("x", 0) * 10
-        start_y = initial_position.get("y", 0) * 10
-        start_theta = initial_position.get("theta", 1.57)
-    start_position = Position(x=start_x, y=start_y, theta=start_theta)  
+    print("Initial position from input:", algo_input["value"].get("initial_position", None))
+    start_position = _start_position(algo_input)
     print("Start position:", start_position)
 
     # Map
@@ -136,11 +185,28 @@ def main(algo_input: AlgoInput, include_both: bool = False):
     # Algorithm
     algo_type = algo_input["algo_type"]
     print("Algorithm: ", algo_type)
-    algo = HamiltonianSearch(map=map, src=start_position, algo_type=algo_type)
+    epsilon = algo_input.get("epsilon") or 1
+    # Commands of every leg as soon as it is found (see `on_leg` of HamiltonianSearch)
+    leg_found = (lambda loc, path: on_leg(_leg_commands(path, loc))) if on_leg is not None else None
+    algo = HamiltonianSearch(map=map, src=start_position, algo_type=algo_type, pool=pool,
+                             epsilon=epsilon, deadline=deadline, on_leg=leg_found)
+    if on_start is not None:
+        on_start(algo)  # e.g. to follow its progress, or cancel it
 
     # Algorithm Search⭐
     min_perm, paths = algo.search()
 
+    # Obstacles left out of the plan, found unreachable before the search or on the way (as obstacle ids of the input)
+    dropped_obstacles = [algo_input["value"]["obstacles"][i-1]["id"] for i in algo.dropped]
+
+    # Nothing to visit (no obstacles, or all of them dropped): the plan is empty, live mode only ends it with FIN
+    if not paths:
+        if algo_server_mode == AlgoInputMode.SIMULATOR:
+            return {"positions": [], "dropped_obstacles": dropped_obstacles, "suboptimality_bound": algo.bound}
+        end_position = AlgoOutputLivePosition(x=start_position.x // 10, y=start_position.y // 10,
+                                              d=convertThetatoNumericDirection(start_position.theta))
+        return {"commands": [AlgoOutputLiveCommand(value="FIN", end_position=end_position)],
+                "dropped_obstacles": dropped_obstacles, "suboptimality_bound": algo.bound}
 
 
     # Generate Simulator Output
@@ -179,31 +245,16 @@ def main(algo_input: AlgoInput, include_both: bool = False):
         value="FIN",
         end_position=algoOutputLiveCommands[-1].end_position
         ))
-        return simulator_algo_output
+        return {"positions": simulator_algo_output, "dropped_obstacles": dropped_obstacles,
+                "suboptimality_bound": algo.bound}
     
     
     if algo_server_mode == AlgoInputMode.LIVE:
         #print("TEST")
-        current_perm = 1
-        stm_commands = []
-
-        for path in paths:
-            commands = convert_segments_to_commands(path)
-            stm_commands.extend(commands)
-
-            # Add SNAP1 command after each path (from one obstacle to another) (For Raspberry Pi Team to know when to scan the image)
-            stm_commands.append([f"SNAP{min_perm[current_perm]}", commands[-1][1]])
-            current_perm += 1 # Increment by current_perm to access the next obstacle_id
-        
-        
         algoOutputLiveCommands: list[AlgoOutputLiveCommand] = [] # Array of commands
-        for command in stm_commands:
-            algoOutputLiveCommands.append(AlgoOutputLiveCommand(
-                # cat="control",
-                value=command[0],
-                end_position=command[1]
-            ))
-        
+        for path, loc in zip(paths, min_perm[1:]):
+            algoOutputLiveCommands.extend(_leg_commands(path, loc))
+
         # Add FIN as the last command (For Raspberry Pi Team to know that the algorithm has ended)
         algoOutputLiveCommands.append(AlgoOutputLiveCommand(
         # cat="control",
@@ -214,7 +265,35 @@ def main(algo_input: AlgoInput, include_both: bool = False):
         
         print("Commands:", algoOutputLiveCommands)
 
-        return algoOutputLiveCommands
+        return {"commands": algoOutputLiveCommands, "dropped_obstacles": dropped_obstacles,
+                "suboptimality_bound": algo.bound}
+
+
+def _leg_commands(path, loc: int) -> list[AlgoOutputLiveCommand]:
+    """
+    Live mode commands of a leg (path from one obstacle to another) to the obstacle at location `loc` of the search
+    """
+    commands = convert_segments_to_commands(path)
+
+    # Add SNAP1 command after each path (from one obstacle to another) (For Raspberry Pi Team to know when to scan the image)
+    commands.append([f"SNAP{loc}", commands[-1][1]])
+    return [AlgoOutputLiveCommand(value=command[0], end_position=command[1]) for command in commands]
+
+
+def _start_position(algo_input: AlgoInput) -> Position:
+    """
+    Helper function to get the start position of the robot from the input (the bottom left corner, facing north, if
+    none is given)
+    """
+    # start_position = Position(x=0, y=0, theta=pi/2)
+    initial_position = algo_input["value"].get("initial_position", None)
+    if initial_position is None:
+        start_x, start_y, start_theta = 0, 0, 1.57
+    else:
+        start_x = initial_position.get("x", 0) * 10
+        start_y = initial_position.get("y", 0) * 10
+        start_theta = initial_position.get("theta", 1.57)
+    return Position(x=start_x, y=start_y, theta=start_theta)
 
 
 def _extract_obstacles_from_input(input_obstacles, algo_server_mode):
@@ -238,11 +317,193 @@ def _extract_obstacles_from_input(input_obstacles, algo_server_mode):
     return obstacles
 
 
+def _canonical_input(algo_input: AlgoInput) -> tuple[tuple, AlgoInput, list[int]]:
+    """
+    Canonical form of a request, the same for every order of its obstacles: its key in `PlanCache`, the request with
+    its obstacles sorted by their position and facing, each with its 1-based location in the sorted list as id, and
+    the index in the request of every obstacle of the sorted list
+    """
+    input_obstacles = algo_input["value"]["obstacles"]
+    obstacles = _extract_obstacles_from_input(input_obstacles, algo_input["server_mode"])
+    order = sorted(range(len(obstacles)),
+                   key=lambda i: (obstacles[i].x, obstacles[i].y, obstacles[i].facing.value))
+    start = _start_position(algo_input)
+
+    key = (
+        tuple((obstacles[i].x, obstacles[i].y, obstacles[i].facing.value) for i in order),
+        (start.x, start.y, start.theta),
+        algo_input["algo_type"],
+        algo_input["server_mode"],
+        INDOOR,  # calibration profile
+        algo_input.get("epsilon") or 1,
+        algo_input.get("time_budget")
+    )
+    canonical = {**algo_input, "value": {
+        **algo_input["value"],
+        "obstacles": [{**input_obstacles[i], "id": loc} for loc, i in enumerate(order, start=1)]
+    }}
+    return key, canonical, order
+
+
+def _from_canonical(result: dict, algo_input: AlgoInput, order: list[int]) -> dict:
+    """The plan of the canonical form of `algo_input` (see `_canonical_input()`) for `algo_input`"""
+    input_obstacles = algo_input["value"]["obstacles"]
+    result = {**copy.deepcopy(result),
+              "dropped_obstacles": [input_obstacles[order[loc - 1]]["id"] for loc in result["dropped_obstacles"]]}
+    if "commands" in result:
+        # SNAP commands take the location of their obstacle in the request
+        for command in result["commands"]:
+            if command.value.startswith("SNAP"):
+                command.value = f"SNAP{order[int(command.value[4:]) - 1] + 1}"
+    return result
+
+
+class PlanCache:
+    """
+    Plans of the latest requests, by the canonical form of the request (see `_canonical_input()`), so that a layout
+    planned before is answered at once, whatever the order of its obstacles. Up to `size` plans are kept, the least
+    recently used are forgotten first
+    """
+
+    def __init__(self, size: int = PLAN_CACHE_SIZE):
+        self.size = size
+        self.plans = OrderedDict()  # key -> plan of the canonical request, least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[dict]:
+        with self.lock:
+            plan = self.plans.get(key)
+            if plan is not None:
+                self.plans.move_to_end(key)
+            return plan
+
+    def put(self, key: tuple, plan: dict):
+        with self.lock:
+            self.plans[key] = plan
+            self.plans.move_to_end(key)
+            while len(self.plans) > self.size:
+                self.plans.popitem(last=False)
+
+
+class Planner:
+    """
+    Runs `main()` off the event loop, so that the server keeps answering while it plans
+
+    At most `workers` plans run at once, on threads (the searches themselves run on the app's `SearchPool`, which
+    interleaves the rows of concurrent plans). Up to `queued` more requests wait for a thread, the others are
+    turned down with a 503.
+
+    Plans are looked up in `cache` first (streamed ones, with `on_leg`, are always searched), and report whether they
+    were found there and the time from the request to the plan.
+    """
+
+    def __init__(self, workers: int = PLANNING_WORKERS, queued: int = PLANNING_QUEUE,
+                 cache: Optional[PlanCache] = None):
+        self.workers = workers
+        self.queued = queued
+        self.cache = cache if cache is not None else PlanCache()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="planner")
+        self.lock = threading.Lock()
+        self.pending = 0  # requests running or waiting, guarded by `lock`
+
+    def submit(self, algo_input: AlgoInput, **kwargs) -> Future:
+        """Queues `main(algo_input, **kwargs)`"""
+        with self.lock:
+            if self.pending >= self.workers + self.queued:
+                raise HTTPException(status_code=503, detail="Too many planning requests, try again later")
+            self.pending += 1
+        future = self.executor.submit(partial(self._plan, algo_input, received=time.time(), **kwargs))
+        future.add_done_callback(self._done)
+        return future
+
+    def _plan(self, algo_input: AlgoInput, received: float, **kwargs) -> dict:
+        cache_hit = False
+        try:
+            if kwargs.get("on_leg") is not None or kwargs.get("include_both"):
+                result = main(algo_input, received=received, **kwargs)
+            else:
+                key, canonical, order = _canonical_input(algo_input)
+                plan = self.cache.get(key)
+                cache_hit = plan is not None
+                if not cache_hit:
+                    plan = main(canonical, received=received, **kwargs)
+                    self.cache.put(key, plan)
+                result = _from_canonical(plan, algo_input, order)
+        except SearchTimeout:
+            raise HTTPException(status_code=504, detail="No plan found within the time budget")
+        return {**result, "cache_hit": cache_hit, "runtime": "{:.4f} seconds".format(time.time() - received)}
+
+    def _done(self, future: Future):
+        with self.lock:
+            self.pending -= 1
+
+    async def plan(self, algo_input: AlgoInput, **kwargs):
+        return await asyncio.wrap_future(self.submit(algo_input, **kwargs))
+
+    def close(self):
+        # waits for the running plans (they need the pool), the waiting ones are cancelled
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class Job:
+    """A plan submitted to `POST /jobs`, run by the `Planner` while its status is polled"""
+
+    def __init__(self, algo_input: AlgoInput):
+        self.id = uuid.uuid4().hex
+        self.algo_input = algo_input
+        self.search = None  # the HamiltonianSearch, once the plan has started
+        self.cancelled = False
+        self.future = None
+
+    def start(self, planner: Planner, pool: SearchPool):
+        self.future = planner.submit(self.algo_input, pool=pool, on_start=self._started)
+
+    def _started(self, search: HamiltonianSearch):
+        self.search = search
+        if self.cancelled:
+            search.cancel()
+
+    def cancel(self):
+        self.cancelled = True
+        if not self.future.cancel() and self.search is not None:
+            self.search.cancel()
+
+    def output(self) -> dict:
+        output = {"job_id": self.id}
+        if self.future.cancelled() or (self.future.done() and isinstance(self.future.exception(), SearchCancelled)):
+            return {**output, "status": "cancelled"}
+        if self.future.done() and self.future.exception() is not None:
+            return {**output, "status": "failed", "error": repr(self.future.exception())}
+
+        if self.search is not None:
+            best_cost = self.search.best_cost
+            output["progress"] = {
+                "edges_done": self.search.edges_done,
+                "edges_total": self.search.edges_total,
+                "best_cost": best_cost if best_cost is not None and math.isfinite(best_cost) else None
+            }
+        if not self.future.done():
+            return {**output, "status": "running" if self.search is not None else "queued"}
+
+        return {**output, "status": "done", "result": self.future.result()}
+
+
 """ -------------------------------------- """
 """ ------ FastAPI (API Endpoints) ------- """
 """ -------------------------------------- """
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pool of search processes for the lifetime of the server, shared by every request
+    app.state.pool = SearchPool(SEARCH_WORKERS).start()
+    app.state.planner = Planner()
+    app.state.jobs = OrderedDict()  # job id -> Job, oldest first
+    yield
+    app.state.planner.close()
+    app.state.pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost",
@@ -278,29 +539,19 @@ async def algo_simulator_test():
         "algo_type": AlgoType.EXHAUSTIVE_ASTAR,
     }
 
-    positions = main(simulator_algo_input)
-
-    return {"positions": positions}
+    return await app.state.planner.plan(simulator_algo_input, pool=app.state.pool)
 
 
 @app.post("/algo/simulator", response_model=AlgoOutputSimulator, tags=["Algorithm"])
 async def algo_simulator(algo_input: AlgoInput):
     """Main endpoint for simulator"""
-    start_time = time.time()
     if hasattr(algo_input, "model_dump"):
      algo_input = algo_input.model_dump()
     else:
      algo_input = algo_input.dict()
 
-    positions = main(algo_input)
-
-    runtime = time.time() - start_time  # in seconds
-
-    # Convert position objects to dicts for FastAPI serialization
-    
-
-    runtime = time.time() - start_time
-    return {"positions": positions, "runtime": "{:.4f} seconds".format(runtime)}
+    # runtime: from the request to the plan (see `Planner`)
+    return await app.state.planner.plan(algo_input, pool=app.state.pool)
 
 
 @app.get("/algo/live/simple-test", response_model=AlgoOutputLive, tags=["Algorithm"])
@@ -316,16 +567,14 @@ async def algo_live_test():
         "server_mode": AlgoInputMode.LIVE,
         "algo_type": AlgoType.EXHAUSTIVE_ASTAR,
     }
-    commands = main(live_algo_input)
-
-    return {"commands": commands}
+    return await app.state.planner.plan(live_algo_input, pool=app.state.pool)
 
 
 @app.post("/optimal", response_model=AlgoOutputLiveResponseNew, tags=["Algorithm"])
 async def algo_live(algo_input: AlgoInput):
     """Main endpoint for live mode"""
     # Get both outputs from main using the include_both flag
-    result = main(algo_input.dict(), include_both=True)
+    result = await app.state.planner.plan(algo_input.dict(), include_both=True, pool=app.state.pool)
     commands = result["live"]
     positions = result["simulator"]
 
@@ -364,6 +613,82 @@ async def algo_live(algo_input: AlgoInput):
      algo_input = algo_input.model_dump()
   else:
      algo_input = algo_input.dict()
-  commands = main(algo_input)
+  return await app.state.planner.plan(algo_input, pool=app.state.pool)
+
+
+@app.post("/jobs", response_model=JobOutput, status_code=202, tags=["Jobs"])
+async def submit_job(algo_input: AlgoInput):
+    """Queues a plan and returns its job id at once, poll `GET /jobs/{job_id}` for its progress and result"""
+    job = Job(algo_input.model_dump())
+    job.start(app.state.planner, app.state.pool)
+
+    # forgets the oldest finished jobs beyond `JOBS_KEPT`
+    jobs = app.state.jobs
+    jobs[job.id] = job
+    finished = [old for old in jobs.values() if old.future.done()]
+    for old in finished[:max(0, len(finished) - JOBS_KEPT)]:
+        del jobs[old.id]
+    return job.output()
 
-  return { "commands": commands }
+
+def _job(job_id: str) -> Job:
+    job = app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+
+@app.get("/jobs/{job_id}", response_model=JobOutput, tags=["Jobs"])
+async def get_job(job_id: str):
+    """Status of a job: progress while it runs, the plan (as `/algo/simulator` or `/algo/live` return it) once done"""
+    return _job(job_id).output()
+
+
+@app.delete("/jobs/{job_id}", response_model=JobOutput, tags=["Jobs"])
+async def cancel_job(job_id: str):
+    """Cancels a job: a queued job never runs, a running one stops at its next row or leg"""
+    job = _job(job_id)
+    job.cancel()
+    return job.output()
+
+
+def _event(event: str, data: BaseModel) -> str:
+    """A Server-Sent Event"""
+    return f"event: {event}\ndata: {data.model_dump_json()}\n\n"
+
+
+@app.post("/algo/live/stream", tags=["Algorithm"])
+async def algo_live_stream(algo_input: AlgoInput):
+    """
+    Live mode, streamed as Server-Sent Events while the plan is searched: a `commands` event (`AlgoOutputLiveBatch`)
+    for every leg as soon as it is found, from the first one, then a `done` event (`AlgoOutputLive` with the FIN
+    command only) or an `error` event. The order of the obstacles is the first one found (see `on_leg` of
+    HamiltonianSearch)
+    """
+    algo_input = algo_input.model_dump()
+    algo_input["server_mode"] = AlgoInputMode.LIVE
+
+    loop = asyncio.get_running_loop()
+    batches = asyncio.Queue()  # commands of the legs found, then None once the plan is done
+    searches = []
+    future = app.state.planner.submit(
+        algo_input, pool=app.state.pool, on_start=searches.append,
+        on_leg=lambda commands: loop.call_soon_threadsafe(batches.put_nowait, commands))
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(batches.put_nowait, None))
+
+    async def events():
+        try:
+            while (commands := await batches.get()) is not None:
+                yield _event("commands", AlgoOutputLiveBatch(commands=commands))
+            if future.exception() is not None:
+                yield _event("error", AlgoOutputError(detail=repr(future.exception())))
+                return
+            result = future.result()
+            yield _event("done", AlgoOutputLive(**{**result, "commands": result["commands"][-1:]}))
+        finally:
+            # the client is gone before the end of the plan
+            if not future.done() and not future.cancel():
+                for search in searches:
+                    search.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -1,41 +1,70 @@
-import heapq
+import math
 from math import pi
 import numpy as np
 import logging
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import time
 
 from arena.map import Map
 from common.consts import (
-    DIST_BL,
-    DIST_BR,
-    DIST_BW,
-    DIST_FL,
-    DIST_FR,
-    DIST_FW,
     PENALTY_STOP,
     MAX_THETA_ERR,
     MAX_X_ERR,
     MAX_Y_ERR,
     MAP_WIDTH,
     MAP_HEIGHT,
+    LATTICE_X,
+    LATTICE_Y,
+    LATTICE_THETA,
+    SNAP_COORD,
 )
-from common.enums import Movement
 from common.types import Position
 from common.utils import calc_vector, euclidean
-from path_finding.path_validation import has_collision
-from robot.move import (
-    bwd,
-    bwd_left,
-    bwd_right,
-    fwd,
-    fwd_left,
-    fwd_right
-)
+from path_finding.heuristics import cost_to_go, goal_distance_field
+from path_finding.lattice import ClosedSet
+from path_finding.open_list import OpenList
+from robot.move import MOTIONS, PRIMITIVES, REVERSED_PRIMITIVES, heading_to_theta
 
 
 logger = logging.getLogger('ASTAR')
 
+# A path in compact form: (lattice states (len(path), 3) int16 array, motion codes (len(path) - 1,) uint8 array)
+CompactPath = Tuple[np.ndarray, np.ndarray]
+
+_MOTION_CODES = {(v, s): code for code, (v, s, *_) in enumerate(MOTIONS)}  # (v, s) -> motion code
+
+DEADLINE_CHECK_POPS = 256  # pops between two checks of a search's deadline
+
+SHOT_EVERY = 32  # pops between two attempts to shoot from the popped node to the goals, see `AStar._shot()`
+SHOT_MAX_TURNS = 4  # most turns (of 45 degrees) at either end of a shot
+
+
+def _turn_table():
+    # _SHOT_TURNS[heading] -> ((motion codes, dx, dy, heading after), ...): the sequences of up to `SHOT_MAX_TURNS`
+    # identical turns (and the empty one) from a lattice heading, with the displacement they make
+    turns = [code for code, (_, s, *_) in enumerate(MOTIONS) if s != 0]
+    words = [()] + [(code,) * n for code in turns for n in range(1, SHOT_MAX_TURNS + 1)]
+    table = []
+    for start in range(LATTICE_THETA):
+        row = []
+        for word in words:
+            x = y = 0
+            heading = start
+            for code in word:
+                *_, dx, dy, heading = PRIMITIVES[heading][code]
+                x += dx
+                y += dy
+            row.append((word, x, y, heading))
+        table.append(tuple(row))
+    return tuple(table)
+
+
+_SHOT_TURNS = _turn_table()
+
+
+class SearchTimeout(Exception):
+    """Raised by a search that runs past its deadline"""
+
 
 class Node:
 
@@ -48,7 +77,8 @@ class Node:
         parent: Optional["Node"] = None,
         v: Optional[int] = 1,
         s: Optional[int] = 0,
-        d: Optional[float] = 0
+        d: Optional[float] = 0,
+        k: Optional[Tuple[int, int, int]] = None
     ):
         self.pos = pos
         self.c_pos = c_pos  # pos in continuous scale
@@ -59,11 +89,12 @@ class Node:
         self.v = v  # prev motion's vert direction, -1: bwd, 1: fwd
         self.s = s  # prev motion's steering direction, -1: left, 0: straight, 1: fwd
         self.d = d  # dist
+        self.k = k if k is not None else pos.to_lattice()  # (x, y, theta) index of the snapped cell
 
         self.parent = parent
 
     def clone(self) -> "Node":
-        return Node(self.pos, self.c_pos, self.g, self.h, self.parent, self.v, self.s, self.d)
+        return Node(self.pos, self.c_pos, self.g, self.h, self.parent, self.v, self.s, self.d, self.k)
 
     def __eq__(
         self,
@@ -84,34 +115,23 @@ class Node:
         return f'Node(x:{self.c_pos.x:6.2f}, y:{self.c_pos.y:6.2f}, θ:{self.c_pos.theta:6.2f}, g:{self.g:6.2f}, h:{self.h:6.2f}, f:{self.f:6.2f}), v:{self.v}, s:{self.s}'
 
 
-class AStar:
+class Goal:
+    """A goal of a search, with its goal region and heuristics"""
 
     def __init__(
         self,
-        mp: "Map"
+        end: "Position",
+        x_bounds: List[float],
+        y_bounds: List[float],
+        field: np.ndarray
     ):
-        # self.moves: (v, s, d, Movement, movement function); See `Node` __init__ for definitions of the respective variables
-        self.moves = (
-            (1,  0, DIST_FW,    Movement.FWD,
-             fwd),         # straight forward
-            (1, -1, DIST_FL[2], Movement.FWD_LEFT,
-             fwd_left),    # 45-degree left turn
-            (1,  1, DIST_FR[2], Movement.FWD_RIGHT,
-             fwd_right),   # 45-degree right turn
-            (-1,  0, DIST_BW,    Movement.BWD,
-             bwd),        # straight backward
-            (-1, -1, DIST_BL[2], Movement.BWD_LEFT,
-             bwd_left),   # 45-degree left turn
-            (-1,  1, DIST_BR[2], Movement.BWD_RIGHT,
-             bwd_right)   # 45-degree right turn
-        )
-        self.map = mp
-        self.end = None
-        self.x_bounds = None
-        self.y_bounds = None
-        # self.collision_checking_time = 0
+        self.end = end
+        self.x_bounds = x_bounds
+        self.y_bounds = y_bounds
+        self.field = field  # see `AStar.heuristic_field()`
+        self.heading = round(end.theta / (2*pi) * LATTICE_THETA) % LATTICE_THETA
 
-    def _goal(
+    def reached(
         self,
         pos: "Position"
     ) -> bool:
@@ -121,95 +141,531 @@ class AStar:
             return True
         return False
 
+    def h(
+        self,
+        pos: "Position",
+        k: Tuple[int, int, int]
+    ) -> float:
+        """Euclidean distance, obstacle-aware and obstacle-free (non-holonomic) lower bounds: the goal cannot be
+        reached if it is inf. The obstacle-aware one only covers the lattice, a pose that snaps outside of it
+        (e.g. an off-lattice start) goes without it
+
+        Every one of them is admissible, but the search keeps one pose per cell: which one depends on the order in
+        which the heuristic expands them, so that a search can find a costlier path (or none) where another
+        heuristic finds one"""
+        h = max(
+            euclidean(pos, self.end),
+            cost_to_go(pos.x, pos.y, k[2], self.end.x, self.end.y, self.heading)
+        )
+        if 0 <= k[0] < LATTICE_X and 0 <= k[1] < LATTICE_Y:
+            return max(h, self.field[k])
+        return h
+
+
+class AStar:
+
+    closed_set = ClosedSet  # type of the closed sets of the searches, cells (see `Node.k`) that have been expanded
+
+    def __init__(
+        self,
+        mp: "Map"
+    ):
+        self.map = mp
+        self.valid_moves = mp.valid_moves()  # shared by every search on this layout
+        self.cell_valid_moves, self.cell_some_valid_moves = mp.cell_valid_moves()
+        self.goals = []  # goals that have not been reached yet
+        self.epsilon = 1  # weight of the heuristic in the open list's priority, g + epsilon * h
+        self.fields = {}  # goal (x, y, theta) -> cost-to-go field, reused by every search to that goal
+        # self.collision_checking_time = 0
+
+    def _h(
+        self,
+        pos: "Position",
+        k: Tuple[int, int, int]
+    ) -> float:
+        # admissible for every remaining goal
+        if len(self.goals) == 1:
+            return self.goals[0].h(pos, k)
+        return min(goal.h(pos, k) for goal in self.goals)
+
+    def _valid(
+        self,
+        node: "Node"
+    ):
+        # collision checking is a lookup in the layout's move tables: the exact one for a node on the lattice, the
+        # bounds of its snapped cell for a node that the primitives' offsets took off the lattice, unless they
+        # disagree on a move, in which case the moves are checked from the node's exact pose
+        k = node.k
+        if not (0 <= k[0] < LATTICE_X and 0 <= k[1] < LATTICE_Y):
+            return self.map.valid_moves_at(node.c_pos)
+        if abs(node.c_pos.x - node.pos.x) < 1e-6 and abs(node.c_pos.y - node.pos.y) < 1e-6:
+            return self.valid_moves[k]
+        valid = self.cell_valid_moves[k]
+        if np.array_equal(valid, self.cell_some_valid_moves[k]):
+            return valid
+        return self.map.valid_moves_at(node.c_pos)
+
+    def _child(
+        self,
+        node: "Node",
+        primitive: tuple
+    ) -> "Node":
+        # the successor of `node` by a motion primitive, as built by `_expand()`
+        code, v, s, d, mv, dx, dy, heading = primitive
+        x = node.c_pos.x + dx
+        y = node.c_pos.y + dy
+        k = (int(round(x / SNAP_COORD)), int(round(y / SNAP_COORD)), heading)
+        theta = heading_to_theta(heading)
+        nxt_pos = Position(x, y, theta)
+
+        penalty = 0
+        if v != node.v or s != node.s:
+            penalty = PENALTY_STOP
+
+        return Node(Position(k[0] * SNAP_COORD, k[1] * SNAP_COORD, theta), nxt_pos, node.g + penalty + d,
+                    self._h(nxt_pos, k), node, v, s, d, k)
+
     def _expand(
         self,
         node: "Node",
     ):
         st = node.c_pos
+        valid = self._valid(node)
+
+        # successors are looked up in the motion primitive table of the node's lattice heading
+        for code, v, s, d, mv, dx, dy, heading in PRIMITIVES[node.k[2]]:
+            x = st.x + dx
+            y = st.y + dy
+            k = (int(round(x / SNAP_COORD)), int(round(y / SNAP_COORD)), heading)
 
-        for v, s, d, mv, f in self.moves:
-            nxt_pos = f(st)
-            nxt_pos_tup = nxt_pos.snap().to_tuple()
+            if not valid[code] or k in self.closed:
+                continue
 
-            # collision_checking_start_time = time.time()
-            if nxt_pos_tup in self.closed or has_collision(st, mv, self.map):
-                # self.collision_checking_time += time.time() - collision_checking_start_time
+            theta = heading_to_theta(heading)
+            nxt_pos = Position(x, y, theta)
+            h = self._h(nxt_pos, k)
+            if h == np.inf:
                 continue
-            # self.collision_checking_time += time.time() - collision_checking_start_time
 
             penalty = 0
             if v != node.v or s != node.s:
                 penalty = PENALTY_STOP
 
-            nxt_node = Node(nxt_pos.snap(), nxt_pos, node.g + penalty +
-                            d, euclidean(nxt_pos, self.end), node, v, s, d)
+            nxt_node = Node(Position(k[0] * SNAP_COORD, k[1] * SNAP_COORD, theta), nxt_pos, node.g + penalty +
+                            d, h, node, v, s, d, k)
 
-            # there is a shorter way to reach a node that is already in open set
-            if self.open_h.get(nxt_pos_tup, -1) > nxt_node.f:
-                for i, br in enumerate(self.open):
-                    if br == nxt_node:
-                        # replace br with cell
-                        br.f = -1
-                        heapq._siftdown(self.open, 0, i)
-                        heapq.heappop(self.open)
-                        break
+            # replaces (lazily) the open entry of the cell if this is a shorter way to reach it
+            self.open.push(k, nxt_node, nxt_node.g + self.epsilon * h, h)
 
-            heapq.heappush(self.open, nxt_node)
-            self.open_h[nxt_pos_tup] = nxt_node.f
+    def _h_back(
+        self,
+        pos: "Position",
+        k: Tuple[int, int, int]
+    ) -> float:
+        # lower bound of the cost from the start of a bidirectional search to `pos` (heuristic of the backward tree)
+        src = self.src
+        return max(
+            euclidean(src, pos),
+            cost_to_go(src.x, src.y, self.src_heading, pos.x, pos.y, k[2])
+        )
 
-    def _set_bounds(self):
-        vv = calc_vector(self.end.theta, 1)
-        vh = calc_vector(self.end.theta - pi/2, 1)
+    def _expand_back(
+        self,
+        node: "Node",
+    ):
+        # predecessors of a node of the backward tree: the poses from which a motion primitive ends at the node.
+        # The node's (v, s) is the motion from it towards the goal, and its parent is where that motion ends
+        st = node.c_pos
+
+        for code, v, s, d, mv, dx, dy, heading in REVERSED_PRIMITIVES[node.k[2]]:
+            x = st.x + dx
+            y = st.y + dy
+            k = (int(round(x / SNAP_COORD)), int(round(y / SNAP_COORD)), heading)
 
-        end = np.array([self.end.x, self.end.y])
+            # the move is kept if it is valid from some pose of the predecessor's cell, the moves of the backward
+            # tree are checked from the exact poses when the trees meet (see `_join()`)
+            if not (0 <= k[0] < LATTICE_X and 0 <= k[1] < LATTICE_Y) or k in self.closed_back or \
+                    not self.cell_some_valid_moves[k][code]:
+                continue
+
+            theta = heading_to_theta(heading)
+            prv_pos = Position(x, y, theta)
+            h = self._h_back(prv_pos, k)
+            if h == np.inf:
+                continue
+
+            penalty = 0
+            if node.parent is not None and (v != node.v or s != node.s):
+                penalty = PENALTY_STOP
+
+            prv_node = Node(Position(k[0] * SNAP_COORD, k[1] * SNAP_COORD, theta), prv_pos, node.g + penalty +
+                            d, h, node, v, s, d, k)
+            self.open_back.push(k, prv_node, prv_node.g + self.epsilon * h, h)
+
+    def replay(
+        self,
+        st: "Position",
+        end: "Position",
+        codes: np.ndarray
+    ) -> List["Node"]:
+        '''Follows the motion codes of a path (see `compact()`) from `st`, checking every move against the layout
+
+        Returns:
+            An array of `Node` from start to goal/end, empty if a move is blocked or the last pose misses the goal'''
+        goal = self._goal(end)
+        self.goals = [goal]
+        node = Node(st.snap(), st, 0, 0)
+        path = [node]
+        for code in codes:
+            if not self._valid(node)[code]:
+                return []
+            node = self._child(node, PRIMITIVES[node.k[2]][code])
+            path.append(node)
+
+        if not goal.reached(node.c_pos):
+            return []
+        return path
+
+    @staticmethod
+    def compact(
+        path: List["Node"]
+    ) -> CompactPath:
+        '''Compact form of a path, to send it between processes'''
+        return (
+            np.array([node.k for node in path], dtype=np.int16),
+            np.array([_MOTION_CODES[node.v, node.s] for node in path[1:]], dtype=np.uint8)
+        )
+
+    def _goal(
+        self,
+        end: "Position"
+    ) -> Goal:
+        return Goal(end, *self._bounds(end), self.heuristic_field(end))
+
+    @staticmethod
+    def _bounds(
+        end: "Position"
+    ) -> Tuple[List[float], List[float]]:
+        vv = calc_vector(end.theta, 1)
+        vh = calc_vector(end.theta - pi/2, 1)
+
+        end = np.array([end.x, end.y])
         _TR = end + vh * MAX_X_ERR[1] + vv * MAX_Y_ERR[0]
         _BL = end - vh * MAX_X_ERR[0] - vv * MAX_Y_ERR[1]
 
-        self.x_bounds = sorted([_TR[0], _BL[0]])
-        self.y_bounds = sorted([_TR[1], _BL[1]])
+        x_bounds = sorted([_TR[0], _BL[0]])
+        y_bounds = sorted([_TR[1], _BL[1]])
 
         # Ensure that the range of the x_bounds and y_bounds are within the MAP DIMENSIONS [0, 200]
-        self.x_bounds = [max(0, self.x_bounds[0]),
-                         min(self.x_bounds[1], MAP_WIDTH)]
-        self.y_bounds = [max(0, self.y_bounds[0]),
-                         min(self.y_bounds[1], MAP_HEIGHT)]
+        x_bounds = [max(0, x_bounds[0]), min(x_bounds[1], MAP_WIDTH)]
+        y_bounds = [max(0, y_bounds[0]), min(y_bounds[1], MAP_HEIGHT)]
+        return x_bounds, y_bounds
+
+    def heuristic_field(
+        self,
+        end: "Position"
+    ) -> np.ndarray:
+        '''Obstacle-aware cost-to-go field of a goal, computed on first use and cached on this instance
+
+        Call it for every goal before the instance is sent to worker processes so that they share the fields.'''
+        key = (end.x, end.y, end.theta)
+        if key not in self.fields:
+            x_bounds, y_bounds = self._bounds(end)
+            # the moves valid from some pose of each cell, so that the field also relaxes the off-lattice poses
+            self.fields[key] = goal_distance_field(self.cell_some_valid_moves, x_bounds, y_bounds, end.theta)
+        return self.fields[key]
 
     def search(
         self,
         st: "Position",
         end: "Position",
+        epsilon: float = 1,
+        deadline: Optional[float] = None
     ) -> List["Node"]:
-        start_time = time.time()
+        return self.search_many(st, [end], epsilon, deadline)[0]
+
+    def search_many(
+        self,
+        st: "Position",
+        ends: List["Position"],
+        epsilon: float = 1,
+        deadline: Optional[float] = None
+    ) -> List[List["Node"]]:
+        '''Searches from `st` to every position of `ends` in a single sweep, until all of them are reached
+
+        Params:
+            `epsilon` = 1: weight of the heuristic (weighted A*), the costs found are within `epsilon` times the
+            lowest ones
+            `deadline` = None: `time.time()` past which the search raises `SearchTimeout`
+
+        Returns:
+            For every end, an array of `Node` from start to that end (empty if it cannot be reached). With a
+            weight, the first way found into a cell closes it, which can cut off ends that an unweighted sweep
+            reaches: the ends missed are searched again without the weight'''
         # self.collision_checking_time = 0
-        logger.info(f'Start search from {st} to {end}')
-        end_node = Node(end, end, 0, 0)
-        self.end = end
-        self.open = [Node(st.snap(), st, 0, 0)]
-        self.open_h = {}  # keep track of unique cells that are in open set
-        self.closed = []
-        self._set_bounds()
-
-        while self.open:
-
-            node = heapq.heappop(self.open)
-            tup = node.pos.to_tuple()
-            logger.debug(f'{node} {node.parent}')
-
-            if self._goal(node.c_pos):
-                logger.info(f'Found goal {end_node}')
-                # print("Astar Search Runtime:", time.time() - start_time, "s")
-                # print("Astar Collision Checking Runtime:", self.collision_checking_time, "s")
-                # print()
+        logger.info(f'Start search from {st} to {", ".join(map(str, ends))}')
+        goals = [self._goal(end) for end in ends]
+        paths = [[] for _ in ends]
+        self.goals = list(goals)
+        self.epsilon = epsilon
+
+        self.open = OpenList()
+        st_node = Node(st.snap(), st, 0, 0)
+        self.open.push(st_node.k, st_node)
+        self.closed = self.closed_set()  # snapped cells that have already been expanded
+
+        while self.open and self.goals:
+
+            node = self.open.pop()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'{node} {node.parent}')
+
+            if deadline is not None and self.open.pops % DEADLINE_CHECK_POPS == 0 and time.time() > deadline:
+                raise SearchTimeout(f'Search from {st} ran past its deadline')
+
+            # the heuristic of nodes pushed before a goal was reached may be lower than it is now: re-queue them
+            if len(self.goals) < len(goals) and node.parent is not None:
+                h = self._h(node.c_pos, node.k)
+                if h > node.h:
+                    if h != np.inf:
+                        node.h, node.f = h, node.g + h
+                        self.open.push(node.k, node, node.g + epsilon * h, h)
+                    continue
+
+            for goal in [goal for goal in self.goals if goal.reached(node.c_pos)]:
+                logger.info(f'Found goal {goal.end}')
+                last = node.clone()
+                last.h = goal.h(node.c_pos, node.k) if node.parent is not None else 0
+                last.f = last.g + last.h
                 # AlgoOutput -> An array of `Node` from start to goal/end
-                return self._reconstruct(node)
-
-            self.closed.append(tup)
+                paths[goals.index(goal)] = self._reconstruct(last)
+                self.goals.remove(goal)
+
+            # tries to reach the goals left in a single analytic expansion
+            if self._shoots(epsilon):
+                for goal in list(self.goals):
+                    path = self._shot(node, goal)
+                    if path and path[-1].g <= self._shot_bound(node, goal, epsilon):
+                        logger.info(f'Shot to goal {goal.end}')
+                        paths[goals.index(goal)] = path
+                        self.goals.remove(goal)
+
+            if not self.goals:
+                break
+            self.closed.add(node.k)
             self._expand(node)
 
-            for o in self.open[:5]:
-                logger.debug(f'{o.c_pos}, {o}')
+        for goal in self.goals:
+            logger.info(f'Unable to reach {goal.end} from {st}')
+        logger.info(f'Open list: {self.open.pushes} pushes, {self.open.pops} pops, {self.open.stale_pops} stale pops')
+        # print("Astar Collision Checking Runtime:", self.collision_checking_time, "s")
+        # print()
+
+        missed = [i for i, path in enumerate(paths) if not path]
+        if epsilon > 1 and missed:
+            logger.info(f'Searching again from {st} without weight for {len(missed)} ends')
+            for i, path in zip(missed, self.search_many(st, [ends[i] for i in missed], 1, deadline)):
+                paths[i] = path
+        return paths
 
-        logger.info(f'Unable to reach {end} from {st}')
+    def _shoots(
+        self,
+        epsilon: float
+    ) -> bool:
+        # whether to shoot from the node just popped: from the start, and then every so often if the search is
+        # weighted
+        return self.open.pops == 1 or (epsilon > 1 and self.open.pops % SHOT_EVERY == 1)
+
+    def _shot_bound(
+        self,
+        node: "Node",
+        goal: Goal,
+        epsilon: float
+    ) -> float:
+        # highest cost of a shot taken from `node`: its priority in the open list, g + epsilon * h. The open list
+        # held a node of a cheapest path to the goal with a priority of at most `epsilon` times the lowest cost, so
+        # that the costs found stay within `epsilon` times the lowest ones (`node.g` alone can already be up to
+        # `epsilon` times the lowest cost of reaching the node, which rules out `epsilon * (g + h)`). The start is
+        # pushed without a heuristic; its cost is 0, so `epsilon` times its heuristic is within the bound too
+        if node.parent is None:
+            return epsilon * goal.h(node.c_pos, node.k)
+        return node.g + epsilon * node.h
+
+    @staticmethod
+    def _goal_cells(
+        goal: Goal
+    ) -> List[Tuple[int, int, int]]:
+        # lattice cells of the goal region, away from its edges by half a cell so that any pose of the cell reached
+        # by following the same moves from elsewhere is in the region too
+        margin = SNAP_COORD / 2
+        cells = []
+        for x in range(max(0, math.ceil((goal.x_bounds[0] + margin) / SNAP_COORD)),
+                       min(LATTICE_X - 1, math.floor((goal.x_bounds[1] - margin) / SNAP_COORD)) + 1):
+            for y in range(max(0, math.ceil((goal.y_bounds[0] + margin) / SNAP_COORD)),
+                           min(LATTICE_Y - 1, math.floor((goal.y_bounds[1] - margin) / SNAP_COORD)) + 1):
+                for heading in range(LATTICE_THETA):
+                    if goal.reached(Position(x * SNAP_COORD, y * SNAP_COORD, heading_to_theta(heading))):
+                        cells.append((x, y, heading))
+        return cells
+
+    def search_bidirectional(
+        self,
+        st: "Position",
+        end: "Position",
+        epsilon: float = 1,
+        deadline: Optional[float] = None
+    ) -> List["Node"]:
+        '''Searches from `st` to `end` with a forward tree grown from `st` and a backward tree grown from `end` (with
+        the reversed motion primitives), the smaller open list being expanded first, until the trees meet on a cell
+        and no cheaper meeting is possible. The path is then completed by following the backward tree's moves from
+        the forward tree's node, so that it is a chain of `Node` like the one of `search()`.
+
+        Falls back to `search()` if no meeting of the trees leads to the goal.
+
+        Params: see `search_many()`
+
+        Returns:
+            An array of `Node` from start to goal/end (empty if it cannot be reached)'''
+        logger.info(f'Start bidirectional search from {st} to {end}')
+        goal = self._goal(end)
+        self.goals = [goal]
+        self.epsilon = epsilon
+        self.src = st
+        self.src_heading = round(st.theta / (2*pi) * LATTICE_THETA) % LATTICE_THETA
+
+        self.open = OpenList()
+        st_node = Node(st.snap(), st, 0, 0)
+        self.open.push(st_node.k, st_node)
+        self.closed = ClosedSet()
+
+        # the backward tree is grown from every cell of the goal region
+        self.open_back = OpenList()
+        for k in self._goal_cells(goal):
+            pos = Position(k[0] * SNAP_COORD, k[1] * SNAP_COORD, heading_to_theta(k[2]))
+            self.open_back.push(k, Node(pos, pos, 0, 0, v=None, s=None, k=k))
+        self.closed_back = ClosedSet()
+
+        closed, closed_back = {}, {}  # cell -> expanded node, of each tree
+        best, path = np.inf, []  # cheapest path found
+        pops = 0
+
+        while self.open and self.open_back:
+            # every cheaper path goes through an open node of each tree
+            if best <= max(self.open.min_priority(), self.open_back.min_priority()):
+                break
+
+            pops += 1
+            if deadline is not None and pops % DEADLINE_CHECK_POPS == 0 and time.time() > deadline:
+                raise SearchTimeout(f'Search from {st} ran past its deadline')
+
+            if len(self.open) <= len(self.open_back):
+                node = self.open.pop()
+                if goal.reached(node.c_pos) and node.g < best:
+                    best, path = node.g, self._reconstruct(node)
+                fwd, back = node, closed_back.get(node.k)
+                closed[node.k] = node
+                self.closed.add(node.k)
+                self._expand(node)
+            else:
+                node = self.open_back.pop()
+                fwd, back = closed.get(node.k), node
+                closed_back[node.k] = node
+                self.closed_back.add(node.k)
+                self._expand_back(node)
+
+            if fwd is not None and back is not None:
+                cost = fwd.g + back.g
+                if back.parent is not None and (fwd.v, fwd.s) != (back.v, back.s):
+                    cost += PENALTY_STOP
+                # the forward node may lie elsewhere in the cell than the backward one, so that the backward moves
+                # followed from it can run into an obstacle: the meeting is only kept if they can be followed
+                if cost < best:
+                    joined = self._join(fwd, back, goal)
+                    if joined:
+                        best, path = cost, joined
+
+        logger.info(f'Open lists: {self.open.pops} forward pops, {self.open_back.pops} backward pops')
+        if not path:
+            logger.info(f'The trees did not meet, searching from {st} to {end} in one direction')
+            return self.search(st, end, epsilon, deadline)
+        return path
+
+    def _join(
+        self,
+        node: "Node",
+        back: "Node",
+        goal: Goal
+    ) -> List["Node"]:
+        # path to a node of the forward tree, followed by the moves of the backward tree from the same cell
+        codes = []
+        while back.parent is not None:
+            codes.append(_MOTION_CODES[back.v, back.s])
+            back = back.parent
+        return self._follow(node, codes, goal)
+
+    def _follow(
+        self,
+        node: "Node",
+        codes: List[int],
+        goal: Goal
+    ) -> List["Node"]:
+        # path to `node`, followed by the moves of `codes` from it (empty if one of them is blocked or the last
+        # pose misses the goal)
+        path = self._reconstruct(node)
+        for code in codes:
+            if not self._valid(node)[code]:
+                return []
+            node = self._child(node, PRIMITIVES[node.k[2]][code])
+            path.append(node)
+
+        if not goal.reached(node.c_pos):
+            return []
+        return path
+
+    def _shot(
+        self,
+        node: "Node",
+        goal: Goal
+    ) -> List["Node"]:
+        '''Analytic expansion of `node` towards `goal`: the paths made of a turn, a straight line and a turn
+        (the turn-straight-turn words of the Dubins and Reeds-Shepp curves, made of the robot's motion primitives,
+        forward or backward) are solved for the length of the straight line, and followed from the cheapest one
+        until one is clear of obstacles
+
+        Returns:
+            An array of `Node` from start to goal/end, empty if no such path reaches the goal'''
+        st = node.c_pos
+        shots = []
+        for turn1, x1, y1, heading in _SHOT_TURNS[node.k[2]]:
+            theta = heading_to_theta(heading)
+            ux, uy = math.cos(theta), math.sin(theta)
+
+            for turn2, x2, y2, end_heading in _SHOT_TURNS[heading]:
+                if (end_heading - goal.heading + 1) % LATTICE_THETA > 2:
+                    continue
+
+                # the straight line runs along the heading reached by the first turn
+                rx = goal.end.x - st.x - x1 - x2
+                ry = goal.end.y - st.y - y1 - y2
+                t = rx * ux + ry * uy
+                code = 0 if t >= 0 else 3
+                n = round(abs(t) / MOTIONS[code][2])
+                t = math.copysign(n * MOTIONS[code][2], t)
+                if not goal.reached(Position(st.x + x1 + t * ux + x2, st.y + y1 + t * uy + y2,
+                                             heading_to_theta(end_heading))):
+                    continue
+
+                codes = [*turn1, *[code] * n, *turn2]
+                cost, prev = 0, _MOTION_CODES[node.v, node.s]
+                for c in codes:
+                    cost += MOTIONS[c][2] + (PENALTY_STOP if c != prev else 0)
+                    prev = c
+                shots.append((cost, codes))
+
+        for _, codes in sorted(shots):
+            path = self._follow(node, codes, goal)
+            if path:
+                return path
         return []
 
     def _reconstruct(
@@ -1,257 +1,216 @@
-from math import acos, atan2, pi 
+from math import pi
+from typing import Optional
 import numpy as np
 
 from arena.map import Map
-from common.consts import ROBOT_TURNING_RADIUS
-from common.enums import TurnDirection, Path, Movement
-from common.types import Position
-from common.utils import calc_vector, rotate_vector
-from path_finding.path_validation import has_collision
+from common.consts import PENALTY_STOP, ROBOT_TURNING_RADIUS
+from common.enums import Path
+from robot.move import MOTIONS
 
 
-class PathParams:
-    """Stores info about a Dubins path"""
+SAMPLE_STEP = 5  # cm between two poses checked along a path
+
+# The path types, in the order of the batch solver's results
+PATH_TYPES = (Path.LSL, Path.LSR, Path.RSL, Path.RSR, Path.LRL, Path.RLR)
+
+# Steering of the 3 segments of every path type (1: left/anticlockwise, 0: straight, -1: right/clockwise)
+SEGMENTS = np.array([
+    [1, 0, 1],     # LSL
+    [1, 0, -1],    # LSR
+    [-1, 0, 1],    # RSL
+    [-1, 0, -1],   # RSR
+    [1, -1, 1],    # LRL
+    [-1, 1, -1],   # RLR
+])
+
+
+class DubinsSolutions:
+    """
+    Dubins paths between many pairs of poses, as found by `dubins_batch()`
+
+    Attributes (N pairs, the 6 path types in the order of `PATH_TYPES`):
+
+        `lengths`: (N, 6, 3) lengths (in cm) of the 3 segments of every path type, nan if it has no solution
+        `total`: (N, 6) total lengths, inf if no solution
+        `pt1`, `pt2`: (N, 6, 3) poses (x, y, theta) at the end of the first and second segments (tangent points)
+        `best`: (N,) index (in `PATH_TYPES`) of the shortest path type of every pair
+        `shortest`: (N,) length of the shortest path of every pair
+    """
 
     def __init__(
         self,
-        type: "Path",
-        p1: np.array,
-        p2: np.array,
-        pt1: np.array,
-        pt2: np.array,
-        arc1: float,
-        s: float,
-        arc2: float
+        lengths: np.ndarray,
+        pt1: np.ndarray,
+        pt2: np.ndarray
     ):
-        self.type = type
-        self.p1 = p1
-        self.p2 = p2
+        self.lengths = lengths
+        self.total = np.where(np.isnan(lengths).any(axis=-1), np.inf, np.nan_to_num(lengths).sum(axis=-1))
         self.pt1 = pt1
         self.pt2 = pt2
-        self.arc1 = arc1
-        self.s = s
-        self.arc2 = arc2
-        self.len = arc1 + s + arc2
-
-
-    def __str__(self) -> str:
-        return f'{self.type}\np1: {self.p1}, p2: {self.p2}\npt1: {self.pt1}, pt2: {self.pt2}\narc1: {self.arc1:.2f}, s: {self.s:.2f}, arc2: {self.arc2:.2f}, len: {self.len:.2f}\n'
-
-
-movements = {
-    (1, -1): Movement.FWD_LEFT,
-    (1, 0): Movement.FWD,
-    (1, 1): Movement.FWD_RIGHT,
-    (-1, -1): Movement.BWD_LEFT,
-    (-1, 0): Movement.BWD,
-    (-1, 1): Movement.BWD_RIGHT
-}
-
-
-class DubinsPath:
-
-    def shortest_path(
-        self, 
-        st: "Position",
-        end: "Position",
-        mp: "Map"
-    ) -> "Path | None":
-        
-        mn_path = None
-        mn_len = float('inf')
-
-        for path in self._find_paths(st, end):
-            if path.type == Path.LSL:
-                dirs = Movement.FWD_LEFT, Movement.FWD_LEFT
-            elif path.type == Path.LSR:
-                dirs = Movement.FWD_LEFT, Movement.FWD_RIGHT
-            elif path.type == Path.RSR:
-                dirs = Movement.FWD_RIGHT, Movement.FWD_RIGHT
-            elif path.type == Path.RSL:
-                dirs = Movement.FWD_RIGHT, Movement.FWD_LEFT
-            else:
-                continue
-
-
-            if has_collision(st, path.arc1, dirs[0], mp):
-                continue
-
-            theta1 = (st.theta + path.arc1 / ROBOT_TURNING_RADIUS) % (2 * pi)
-            if has_collision(
-                Position(
-                    path.pt1[0], 
-                    path.pt1[1], 
-                    theta1,
-                ), 
-                path.s, 
-                Movement.FWD, 
-                mp
-            ):
-                continue
-
-            if has_collision(
-                Position(
-                    path.pt1[0], 
-                    path.pt1[1], 
-                    (theta1 + path.arc2 / ROBOT_TURNING_RADIUS) % (2 * pi)
-                ),
-                path.arc2, 
-                dirs[1], 
-                mp
-            ):
-                continue
-            
-            if path.len < mn_len:
-                mn_len = path.len
-                mn_path = path
-
-        return mn_path
-
-
-    def _find_paths(
-        self,
-        st: "Position",
-        end: "Position"
-    ):
-        self.s = np.array([st.x, st.y])
-        self.e = np.array([end.x, end.y])
-
-        self.lc1 = calc_vector(st.theta + pi/2, ROBOT_TURNING_RADIUS)
-        self.lc2 = calc_vector(end.theta + pi/2, ROBOT_TURNING_RADIUS)
-        self.rc1 = -self.lc1
-        self.rc2 = -self.lc2
-
-        solns = [self._LSL(), self._RSR(), self._LSR(), self._RSL()]
-
-        return solns
-    
-    
-    def _directional_theta(
-        self, 
-        v1: np.array, 
-        v2: np.array,
-        direction: "TurnDirection"
-    ) -> float:
-        theta = atan2(*v1) - atan2(*v2)
-
-        if theta < 0 and direction == TurnDirection.ANTICLOCKWISE:
-            theta += 2 * pi
-        elif theta > 0 and direction == TurnDirection.CLOCKWISE:
-            theta -= 2 * pi
-        return theta
-    
-
-    def _arc_len(
-        self,
-        theta: float
-    ) -> float:
-        return 2 * pi * ROBOT_TURNING_RADIUS * abs(theta) / 2 / pi
-        
-    
-    def _LSL(self):
-        v = (self.e + self.lc2) - (self.s + self.lc1)
-        m = np.linalg.norm(v)
-        vn = ROBOT_TURNING_RADIUS / m * np.array([v[1], -v[0]]) # rotate 90 deg counter clockwise
-        
-        pt1 = self.s + self.lc1 + vn
-        pt2 = self.e + self.lc2 + vn
-
-        theta1 = self._directional_theta(-self.lc1, vn, TurnDirection.ANTICLOCKWISE)
-        theta2 = self._directional_theta(vn, -self.lc2, TurnDirection.ANTICLOCKWISE)
-
-        arc1 = self._arc_len(theta1)
-        arc2 = self._arc_len(theta2)
-        
-        return PathParams(
-            Path.LSL,
-            self.s + self.lc1,
-            self.e + self.lc2, 
-            pt1,
-            pt2,
-            arc1,
-            m,
-            arc2
-        )
-    
-    def _RSR(self):
-        v = (self.e + self.rc2) - (self.s + self.rc1)
-        m = np.linalg.norm(v)
-        vn = ROBOT_TURNING_RADIUS / m * np.array([-v[1], v[0]]) # rotate 90 deg clockwise
-        
-        pt1 = self.s + self.rc1 + vn
-        pt2 = self.e + self.rc2 + vn
-
-        theta1 = self._directional_theta(-self.rc1, vn, TurnDirection.CLOCKWISE)
-        theta2 = self._directional_theta(vn, -self.rc2, TurnDirection.CLOCKWISE)
-
-        arc1 = self._arc_len(theta1)
-        arc2 = self._arc_len(theta2)
-        
-        return PathParams(
-            Path.RSR,
-            self.s + self.rc1,
-            self.e + self.rc2, 
-            pt1,
-            pt2,
-            arc1,
-            m,
-            arc2
-        )
-    
-    def _LSR(self):
-        v = (self.e + self.rc2) - (self.s + self.lc1)
-        m = np.linalg.norm(v)
-        d = (m**2 + (ROBOT_TURNING_RADIUS*2)**2)**0.5
-
-        phi = acos(2*ROBOT_TURNING_RADIUS/m)
-        v1n = ROBOT_TURNING_RADIUS / m * rotate_vector(v, -phi)
-        v2n = ROBOT_TURNING_RADIUS / m * rotate_vector(-v, -phi)
-        
-        pt1 = self.s + self.lc1 + v1n
-        pt2 = self.e + self.rc2 + v2n
-
-        theta1 = self._directional_theta(-self.lc1, v1n, TurnDirection.ANTICLOCKWISE)
-        theta2 = self._directional_theta(v2n, -self.rc2, TurnDirection.CLOCKWISE)
-
-        arc1 = self._arc_len(theta1)
-        arc2 = self._arc_len(theta2)
-        
-        return PathParams(
-            Path.LSR,
-            self.s + self.lc1,
-            self.e + self.rc2,
-            pt1,
-            pt2,
-            arc1,
-            d, 
-            arc2
-        )
-    
-    def _RSL(self):
-        v = (self.e + self.lc2) - (self.s + self.rc1)
-        m = np.linalg.norm(v)
-        d = (m**2 + (ROBOT_TURNING_RADIUS*2)**2)**0.5
-
-        phi = acos(2*ROBOT_TURNING_RADIUS/m)
-        v1n = ROBOT_TURNING_RADIUS / m * rotate_vector(v, phi)
-        v2n = ROBOT_TURNING_RADIUS / m * rotate_vector(-v, phi)
-        
-        pt1 = self.s + self.rc1 + v1n
-        pt2 = self.e + self.lc2 + v2n
-
-        theta1 = self._directional_theta(-self.rc1, v1n, TurnDirection.CLOCKWISE)
-        theta2 = self._directional_theta(v2n, -self.lc2, TurnDirection.ANTICLOCKWISE)
-
-        arc1 = self._arc_len(theta1)
-        arc2 = self._arc_len(theta2)
-        
-        return PathParams(
-            Path.RSL,
-            self.s + self.rc1,
-            self.e + self.lc2,
-            pt1,
-            pt2,
-            arc1,
-            d, 
-            arc2
-        )
\ No newline at end of file
+        self.best = self.total.argmin(axis=-1)
+        self.shortest = np.take_along_axis(self.total, self.best[:, None], axis=-1)[:, 0]
+
+    def types(self) -> list:
+        """The shortest `Path` type of every pair"""
+        return [PATH_TYPES[i] for i in self.best]
+
+
+def _mod2pi(theta: np.ndarray) -> np.ndarray:
+    return np.mod(theta, 2 * pi)
+
+
+def advance(
+    poses: np.ndarray,
+    steering: np.ndarray,
+    length: np.ndarray,
+    radius: float = ROBOT_TURNING_RADIUS
+) -> np.ndarray:
+    """Poses (..., 3) reached by driving `length` cm forward from `poses` with a `steering` (1: left, 0: straight,
+    -1: right), every argument broadcast against the others"""
+    x, y, theta = poses[..., 0], poses[..., 1], poses[..., 2]
+    turn = steering != 0
+    dtheta = steering * length / radius
+    new_theta = theta + dtheta
+    # arcs: around the turning circle on the side of the steering; straight lines: along the heading
+    with np.errstate(invalid='ignore', divide='ignore'):
+        nx = np.where(turn, x + radius * steering * (np.sin(new_theta) - np.sin(theta)), x + length * np.cos(theta))
+        ny = np.where(turn, y - radius * steering * (np.cos(new_theta) - np.cos(theta)), y + length * np.sin(theta))
+    return np.stack([nx, ny, _mod2pi(new_theta)], axis=-1)
+
+
+def dubins_batch(
+    st: np.ndarray,
+    end: np.ndarray,
+    radius: float = ROBOT_TURNING_RADIUS
+) -> DubinsSolutions:
+    """
+    Solves the 6 Dubins path types (LSL, LSR, RSL, RSR, LRL, RLR) between N pairs of poses at once
+
+    Args:
+        st, end (np.ndarray) : (N, 3) arrays of the start and end poses (x, y, theta)
+        radius (float) : turning radius
+
+    Returns:
+        DubinsSolutions
+    """
+    st = np.asarray(st, dtype=float).reshape(-1, 3)
+    end = np.asarray(end, dtype=float).reshape(-1, 3)
+
+    # normalised problem: start at the origin, the end on the x axis at distance d (in turning radii)
+    dx, dy = end[:, 0] - st[:, 0], end[:, 1] - st[:, 1]
+    d = np.hypot(dx, dy) / radius
+    phi = np.arctan2(dy, dx)
+    a = _mod2pi(st[:, 2] - phi)
+    b = _mod2pi(end[:, 2] - phi)
+    sa, sb, ca, cb = np.sin(a), np.sin(b), np.cos(a), np.cos(b)
+    cab = np.cos(a - b)
+
+    # (t, p, q): angles of the turns and length of the straight, in turning radii, nan if no solution
+    with np.errstate(invalid='ignore'):
+        p2 = 2 + d*d - 2*cab + 2*d*(sa - sb)
+        tmp = np.arctan2(cb - ca, d + sa - sb)
+        lsl = (_mod2pi(tmp - a), np.sqrt(p2), _mod2pi(b - tmp))
+
+        p2 = -2 + d*d + 2*cab + 2*d*(sa + sb)
+        p = np.sqrt(p2)
+        tmp = np.arctan2(-ca - cb, d + sa + sb) - np.arctan2(-2.0, p)
+        lsr = (_mod2pi(tmp - a), p, _mod2pi(tmp - _mod2pi(b)))
+
+        p2 = -2 + d*d + 2*cab - 2*d*(sa + sb)
+        p = np.sqrt(p2)
+        tmp = np.arctan2(ca + cb, d - sa - sb) - np.arctan2(2.0, p)
+        rsl = (_mod2pi(a - tmp), p, _mod2pi(b - tmp))
+
+        p2 = 2 + d*d - 2*cab + 2*d*(sb - sa)
+        tmp = np.arctan2(ca - cb, d - sa + sb)
+        rsr = (_mod2pi(a - tmp), np.sqrt(p2), _mod2pi(tmp - b))
+
+        p = _mod2pi(2*pi - np.arccos((6 - d*d + 2*cab + 2*d*(sb - sa)) / 8))
+        t = _mod2pi(-a - np.arctan2(ca - cb, d + sa - sb) + p/2)
+        lrl = (t, p, _mod2pi(_mod2pi(b) - a - t + p))
+
+        p = _mod2pi(2*pi - np.arccos((6 - d*d + 2*cab + 2*d*(sa - sb)) / 8))
+        t = _mod2pi(a - np.arctan2(ca - cb, d - sa + sb) + p/2)
+        rlr = (t, p, _mod2pi(a - b - t + p))
+
+    lengths = np.stack([np.stack(seg, axis=-1) for seg in (lsl, lsr, rsl, rsr, lrl, rlr)], axis=1) * radius
+
+    # tangent points, by driving the first two segments from the start
+    starts = np.broadcast_to(st[:, None, :], lengths.shape)
+    pt1 = advance(starts, SEGMENTS[None, :, 0], lengths[..., 0], radius)
+    pt2 = advance(pt1, SEGMENTS[None, :, 1], lengths[..., 1], radius)
+    return DubinsSolutions(lengths, pt1, pt2)
+
+
+def primitive_costs(
+    sol: DubinsSolutions,
+    reverse: bool = False,
+    radius: float = ROBOT_TURNING_RADIUS
+) -> np.ndarray:
+    """
+    (N, 6) costs of the paths of `sol` in the units of the A* costs: the straights and arcs are costed like the
+    straight and turning motion primitives (per cm and per radian), plus `PENALTY_STOP` for every change of motion,
+    the robot starting as if it had just driven straight forward. inf if no solution.
+
+    With `reverse`, the paths are driven backward (see `clear_paths()`).
+    """
+    v = -1 if reverse else 1
+    per_cm = MOTIONS[0][2] / MOTIONS[0][5]
+    per_rad = MOTIONS[1][2] / (pi / 4)
+
+    lengths = np.nan_to_num(sol.lengths)
+    turning = SEGMENTS[None, :, :] != 0
+    cost = np.where(turning, lengths / radius * per_rad, lengths * per_cm).sum(axis=-1)
+
+    # changes of motion, skipping the empty segments
+    prev_v = np.ones(cost.shape, dtype=int)
+    prev_s = np.zeros(cost.shape, dtype=int)
+    for i in range(3):
+        moving = lengths[..., i] > 1e-6
+        s = np.broadcast_to(SEGMENTS[None, :, i], cost.shape)
+        cost += PENALTY_STOP * (moving & ((prev_v != v) | (prev_s != s)))
+        prev_v = np.where(moving, v, prev_v)
+        prev_s = np.where(moving, s, prev_s)
+    return np.where(np.isfinite(sol.total), cost, np.inf)
+
+
+def clear_paths(
+    sol: DubinsSolutions,
+    st: np.ndarray,
+    mp: "Map",
+    reverse: bool = False,
+    checked: Optional[np.ndarray] = None,
+    step: float = SAMPLE_STEP
+) -> np.ndarray:
+    """
+    (N, 6) mask of the paths of `sol` (solved from the (N, 3) poses `st`) that the robot can drive within the arena
+    and clear of the obstacles of `mp`, checked every `step` cm or less along every path in one batch.
+
+    With `reverse`, the paths were solved for the poses turned around (theta + pi), i.e. they are driven backward.
+    `checked` is an optional (N, len(mp.obstacles)) mask of the obstacles each path is checked against.
+    """
+    n, m = sol.total.shape
+    finite = np.isfinite(sol.total)
+    if not finite.any():
+        return finite
+
+    # distances along every path at which it is checked
+    k = int(np.ceil(sol.total[finite].max() / step)) + 1
+    dist = np.linspace(0, 1, k)[None, None, :] * np.where(finite, sol.total, 0)[..., None]  # (N, 6, k)
+
+    # segment of every distance, and the pose and steering it starts with
+    lengths = np.nan_to_num(sol.lengths)
+    ends = np.cumsum(lengths, axis=-1)  # (N, 6, 3)
+    seg = (dist > ends[..., 0:1]).astype(int) + (dist > ends[..., 1:2])
+    starts = np.stack([np.broadcast_to(st[:, None, :], sol.pt1.shape), sol.pt1, sol.pt2], axis=2)  # (N, 6, 3, 3)
+    start = np.take_along_axis(starts, seg[..., None], axis=2)  # (N, 6, k, 3)
+    offset = np.take_along_axis(np.concatenate([np.zeros((n, m, 1)), ends[..., :2]], axis=-1), seg, axis=-1)
+    steering = np.take_along_axis(np.broadcast_to(SEGMENTS[None, :, :], (n, m, 3)), seg, axis=-1)
+
+    poses = advance(start, steering, dist - offset)
+    if reverse:
+        poses[..., 2] = (poses[..., 2] + pi) % (2 * pi)
+    if checked is not None:
+        checked = np.repeat(checked, m * k, axis=0)
+    valid = mp.is_valid_batch(poses.reshape(-1, 3), checked=checked).reshape(n, m, k).all(axis=-1)
+    return finite & valid
@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from arena.map import Map
+from common.consts import INDOOR, SNAP_COORD
+from common.types import Position
+from path_finding.astar import AStar, CompactPath
+from path_finding.heuristics import _ctg_fingerprint
+
+
+logger = logging.getLogger('EDGE STORE')
+
+# SQLite database of the edges, shared by every process using it (no store if unset or "")
+EDGE_STORE_PATH = os.environ.get("EDGE_STORE") or None
+EDGE_STORE_TIMEOUT = 30  # seconds a process waits for another one writing to the store
+
+# Furthest an obstacle's middle can be from a pose and still be checked for a move from it (see `Map.bounds`)
+MOVE_REACH = max(math.hypot(max(left, right), max(front, back)) for left, right, front, back in Map.bounds.values())
+# Furthest the exact poses of a path can be from its lattice cells
+POSE_SLACK = SNAP_COORD
+
+
+def _profile() -> str:
+    """Short hash of the calibration the edges depend on (motion primitives, waypoints and regions of the moves), so
+    that edges found with another calibration profile are never used"""
+    key = repr((_ctg_fingerprint(), INDOOR, Map.bounds, Map.waypoints))
+    return hashlib.sha1(key.encode()).hexdigest()[:10]
+
+
+def _pose(pos: "Position") -> str:
+    return f'{pos.x:.1f},{pos.y:.1f},{pos.theta % (2 * math.pi):.3f}'
+
+
+def relevant_obstacles(
+    mp: "Map",
+    cells: np.ndarray
+) -> str:
+    """Signature of the obstacles around a path (its lattice cells, see `AStar.compact()`): those within `MOVE_REACH`
+    of one of its poses, the only ones its moves are checked against"""
+    if not mp.obstacles:
+        return ''
+    middles = np.array([o.middle for o in mp.obstacles], dtype=float)
+    poses = cells[:, :2].astype(float) * SNAP_COORD
+    dist = np.hypot(middles[:, None, 0] - poses[None, :, 0], middles[:, None, 1] - poses[None, :, 1]).min(axis=1)
+    near = dist <= MOVE_REACH + POSE_SLACK
+    key = sorted((o.x, o.y, o.facing.value) for o, n in zip(mp.obstacles, near) if n)
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+class EdgeStore:
+    """
+    Edges (cost and compact path from one pose to another) found by the `SearchProcess` workers, kept on disk in a
+    SQLite database so that the legs shared by different layouts are searched once, by any process of any server on
+    the machine, and are still there after a restart
+
+    An edge is stored with the signature of the obstacles around its path (see `relevant_obstacles()`), the
+    `epsilon` it was searched with and the calibration profile. It is only used by searches of the same profile and
+    a larger or equal `epsilon` where the obstacles around its path are the same, whatever the obstacles elsewhere,
+    and if its path can still be followed (see `AStar.replay()`): layouts that differ away from a leg share its edge.
+    Its cost is that of a clear path, within `epsilon` of the lowest one on the layout it was searched on, an
+    obstacle missing away from it may open a cheaper path on another layout.
+
+    The database is written in WAL mode, so that readers never wait for a writer, and writers wait up to
+    `EDGE_STORE_TIMEOUT` for each other. The store is skipped (with a warning) if the database cannot be used.
+
+    Params:
+
+        `path` = EDGE_STORE_PATH: Path of the database, None or "" for no store
+    """
+
+    def __init__(self, path: Optional[str] = EDGE_STORE_PATH):
+        self.path = path or None
+        self.profile = _profile()
+        self.conn = None  # opened by the process using the store, a connection cannot be shared between processes
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self.conn is None and self.path is not None:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                conn = sqlite3.connect(self.path, timeout=EDGE_STORE_TIMEOUT)
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+                with conn:
+                    conn.execute('''CREATE TABLE IF NOT EXISTS edges (
+                        profile TEXT, algo TEXT, src TEXT, dst TEXT, epsilon REAL, obstacles TEXT,
+                        cost REAL, cells BLOB, codes BLOB,
+                        PRIMARY KEY (profile, algo, src, dst, epsilon, obstacles))''')
+                self.conn = conn
+            except sqlite3.Error:
+                logger.warning(f'Cannot use the edge store at {self.path}, searching every edge', exc_info=True)
+                self.path = None
+        return self.conn
+
+    def get(
+        self,
+        astar: "AStar",
+        algo: str,
+        epsilon: float,
+        st: "Position",
+        end: "Position"
+    ) -> Optional[Tuple[float, CompactPath]]:
+        """The cheapest stored edge from `st` to `end` that holds on the layout of `astar`, if any"""
+        conn = self._connect()
+        if conn is None:
+            return None
+        try:
+            rows = conn.execute(
+                'SELECT obstacles, cost, cells, codes FROM edges '
+                'WHERE profile = ? AND algo = ? AND src = ? AND dst = ? AND epsilon <= ? ORDER BY cost',
+                (self.profile, algo, _pose(st), _pose(end), epsilon)).fetchall()
+        except sqlite3.Error:
+            logger.warning('Cannot read the edge store', exc_info=True)
+            return None
+
+        for obstacles, cost, cells, codes in rows:
+            cells = np.frombuffer(cells, dtype=np.int16).reshape(-1, 3).copy()
+            codes = np.frombuffer(codes, dtype=np.uint8).copy()
+            if obstacles == relevant_obstacles(astar.map, cells) and astar.replay(st, end, codes):
+                return cost, (cells, codes)
+        return None
+
+    def put_many(
+        self,
+        mp: "Map",
+        algo: str,
+        epsilon: float,
+        st: "Position",
+        edges: List[Tuple["Position", float, CompactPath]]
+    ):
+        """Stores the edges (end, cost, compact path) found from `st` on `mp`, in a single transaction"""
+        conn = self._connect()
+        if conn is None or not edges:
+            return
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO edges VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(self.profile, algo, _pose(st), _pose(end), epsilon, relevant_obstacles(mp, cells),
+                      cost, cells.tobytes(), codes.tobytes()) for end, cost, (cells, codes) in edges])
+        except sqlite3.Error:
+            logger.warning('Cannot write to the edge store', exc_info=True)
@@ -1,21 +1,39 @@
-import heapq
 import logging
+import math
 import multiprocessing as mp
+import os
+import queue
+import threading
 import time
-from typing import List
-import math
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from itertools import count
+from typing import Callable, List, Optional, Tuple
 from enum import Enum
 
+import numpy as np
+
 from arena.map import Map
+from common.consts import LATTICE_X, LATTICE_Y, MAX_THETA_ERR
 from common.types import Position
 from common.utils import euclidean
-from path_finding.astar import AStar, Node
+from path_finding.astar import AStar, CompactPath, Node, SearchTimeout
+from path_finding.edge_store import EdgeStore
+from path_finding.dubins_path import clear_paths, dubins_batch, primitive_costs
+from path_finding.hybrid_astar import HybridAStar
 
 
 MAX_ASTAR_F_COST = 99999
+BIDIRECTIONAL_MIN_DIST = 80  # legs at least this long (in cm) are searched from both ends, see `AStar.search_bidirectional()`
+ANYTIME_EPSILONS = (2.5, 1.5, 1)  # weights of the anytime passes of a search with a deadline, the last is optimal
+DUBINS_BLOCKED_FACTOR = 2  # cost factor of the cheapest Dubins path between two locations if all of them collide
 
 logger = logging.getLogger('HAMILTONIAN PATH')
 
+
+class SearchCancelled(Exception):
+    """Raised by `HamiltonianSearch.search()` once `HamiltonianSearch.cancel()` has been called"""
+
 # `knn()` -> Not Used
 def knn(mp: "Map", src: "Position") -> List[List["Node"]]:
     astar = AStar(mp)
@@ -41,27 +59,54 @@ def knn(mp: "Map", src: "Position") -> List[List["Node"]]:
     return res
 
 
-def _permutate(n: int, start_from_zero: bool) -> List[List[int]]:
+def held_karp(edges: List[List[float]], k: int = 1) -> List[Tuple[float, List[int]]]:
     """
-    This function generates all permutations of numbers from 0 to n-1 and returns them as a list of lists. 
-    If `start_from_zero` is True, it filters the permutations to include only those where 0 is the first element.
+    Finds the `k` lowest cost orders of visiting every location once, starting from location 0 (Held-Karp dynamic
+    programming over the subsets of visited locations, keeping the `k` best partial orders of every state).
+    The subsets of the same size are processed together with numpy.
 
     Example:
-        If n = 4, the function will return the permutations of [[0, 1, 2, 3]] or [[1, 2, 3, 0]] depending on the value of start_from_zero.
+        With `edges[i][j]` the cost from location i to location j, `held_karp(edges, 3)` returns the 3 cheapest
+        [(cost, [0, ...]), ...], cheapest first (fewer if there are fewer orders).
 
     """
+    n = len(edges)
+    m = n - 1  # locations to visit, bit i-1 of a subset is location i
+    if m == 0:
+        return [(0, [0])]
+
+    w = np.asarray(edges, dtype=float)
+    # cost[subset, j, r]: r-th lowest cost of visiting `subset` from 0, ending at location j+1
+    cost = np.full((1 << m, m, k), np.inf)
+    prev = np.zeros((1 << m, m, k), dtype=int)  # index (location * k + rank) of the partial order it extends
+    for j in range(m):
+        cost[1 << j, j, 0] = w[0, j+1]
+
+    subsets = np.arange(1 << m)
+    size = np.array([bin(subset).count('1') for subset in subsets])
+    for s in range(2, m+1):
+        layer = subsets[size == s]
+        for j in range(m):
+            with_j = layer[(layer >> j) & 1 == 1]
+            # extend the k best orders of every location i of the subset without j by going from i to j
+            options = (cost[with_j ^ (1 << j)] + w[1:, j+1][None, :, None]).reshape(len(with_j), m*k)
+            best = np.argsort(options, axis=1, kind='stable')[:, :k]
+            cost[with_j, j] = np.take_along_axis(options, best, axis=1)
+            prev[with_j, j] = best
+
+    full = (1 << m) - 1
     res = []
-
-    def helper(curr: List[int]):
-        if len(curr) == n:
-            res.append(curr)
-            return
-        for i in range(n):
-            if i not in curr:
-                helper([*curr, i])
-    helper([])
-    if start_from_zero:
-        res = list(filter(lambda p:p[0] == 0, res))
+    for idx in np.argsort(cost[full].ravel(), kind='stable')[:k]:
+        if cost[full].ravel()[idx] == np.inf:
+            break
+        order = []
+        subset, (j, r) = full, divmod(int(idx), k)
+        while True:
+            order.append(j+1)
+            if subset == 1 << j:
+                break
+            subset, (j, r) = subset ^ (1 << j), divmod(int(prev[subset, j, r]), k)
+        res.append((float(cost[full].ravel()[idx]), [0, *order[::-1]]))
     return res
 
 
@@ -69,86 +114,281 @@ class AlgoType(Enum):
     """Enumeration for possible algorithms to be used for `HamiltonianSearch`"""
     EXHAUSTIVE_ASTAR = "Exhaustive Astar"
     EUCLIDEAN = "Euclidean"
+    DUBINS = "Dubins"
+    HYBRID_ASTAR = "Hybrid Astar"
     BFS = "Breadth First Search"
 
 class SearchProcess(mp.Process):
-    """A Process (similar to a Thread) used for multiprocessing to speed up algorithm computation time"""
+    """A Process (similar to a Thread) used for multiprocessing to speed up algorithm computation time
+
+    Long-lived worker of a `SearchPool`, reading its own `inbox`: a layout (`AStar`, positions and `AlgoType`) is
+    received once, before the first row of that layout assigned to the worker, and kept for the rows of every pass of
+    the plan, which only carry their weight and deadline. The A* edges are looked
+    up in the `EdgeStore` before being searched, and the ones searched are added to it"""
     def __init__(
         self,
-        pos: List["Position"],
-        astar: AStar,
-        todo: mp.Queue,
+        inbox: mp.Queue,
         done: mp.Queue,
-        i:int,
-        algo_type = AlgoType
+        i:int
     ):
         super().__init__()
-        self.astar = astar
-        self.pos = pos
-        self.todo = todo
+        self.inbox = inbox
         self.done = done
         self.i = i
-        self.algo_type = algo_type
+        self.layouts = {}  # layout id -> (astar, pos, algo_type)
+        self.edges = EdgeStore()
         logger.info(f'Spawning P{i}')
 
 
     def _search(
         self,
+        layout: int,
         st: int,
-        end: int
-    ) -> float:
-        """Search According to the `AlgoType`
+        ends: List[int],
+        epsilon: float,
+        deadline: Optional[float]
+    ) -> List[Tuple[float, Optional[CompactPath]]]:
+        """Search According to the `AlgoType`, from `st` to every position of `ends`
         @returns:
-            Exhaustive Astar: Astar 'f' cost
-            Euclidean: Euclidean Distance
-            BST: BST cost ('g' cost)
+            Exhaustive Astar: Astar 'f' costs (a single sweep reaching every end) and the paths in compact form
+            Hybrid Astar: the same, searched by `HybridAStar`
+            Euclidean: Euclidean Distances (no paths)
+            BST: BST costs ('g' cost)
         """
-        logger.info(f'P{self.i} start search {st, end}')
-
-        match (self.algo_type):
-            case AlgoType.EXHAUSTIVE_ASTAR:
-                # Returns astar 'f' cost
-                path = self.astar.search(self.pos[st], self.pos[end])
-                return path[-1].f if path else MAX_ASTAR_F_COST
+        logger.info(f'P{self.i} start search {st, ends}')
+        astar, pos, algo_type = self.layouts[layout]
+
+        match (algo_type):
+            case AlgoType.EXHAUSTIVE_ASTAR | AlgoType.HYBRID_ASTAR:
+                # Returns astar 'f' cost, from the edge store if it holds the edge. The long legs are searched from
+                # both ends (on the lattice), the others in a single sweep
+                stored = {end: self.edges.get(astar, algo_type.value, epsilon, pos[st], pos[end]) for end in ends}
+                todo = [end for end in ends if stored[end] is None]
+                far = [
+                    end for end in todo
+                    if algo_type == AlgoType.EXHAUSTIVE_ASTAR and euclidean(pos[st], pos[end]) >= BIDIRECTIONAL_MIN_DIST
+                ]
+                near = [end for end in todo if end not in far]
+                paths = dict(zip(near, astar.search_many(pos[st], [pos[end] for end in near], epsilon, deadline)))
+                for end in far:
+                    paths[end] = astar.search_bidirectional(pos[st], pos[end], epsilon, deadline)
+
+                found = {end: (paths[end][-1].f, astar.compact(paths[end])) for end in todo if paths[end]}
+                self.edges.put_many(astar.map, algo_type.value, epsilon, pos[st],
+                                    [(pos[end], *found[end]) for end in found])
+                return [stored[end] or found.get(end, (MAX_ASTAR_F_COST, None)) for end in ends]
             case AlgoType.EUCLIDEAN:
                 # Return Euclidean Distance
-                start_pos = self.pos[st]
-                end_pos = self.pos[end]
-                euclidean_distance = math.sqrt((end_pos.x - start_pos.x) ** 2 + (end_pos.y - start_pos.y) ** 2)
-                return euclidean_distance
+                start_pos = pos[st]
+                return [(euclidean(start_pos, pos[end]), None) for end in ends]
             case AlgoType.BFS:
                 # TODO: BFS
                 raise NotImplementedError()
             case _:
                 raise Exception("Invalid AlgoType")
-    
+
     def run(self):
         while 1:
-            try:
-                st, end = self.todo.get()
-                self.done.put((st, end, self._search(st, end)))
-            except:
+            msg = self.inbox.get()
+            if msg is None:
                 logger.info(f'P{self.i} finished')
                 return
 
+            match msg:
+                case ('layout', layout, astar, pos, algo_type):
+                    self.layouts[layout] = astar, pos, algo_type
+                case ('drop', layout):
+                    self.layouts.pop(layout, None)
+                case ('row', job, layout, st, ends, epsilon, deadline):
+                    try:
+                        res = self._search(layout, st, ends, epsilon, deadline)
+                    except SearchTimeout as e:
+                        logger.info(f'P{self.i} stopped searching {st, ends} at the deadline')
+                        res = e
+                    except Exception as e:
+                        logger.exception(f'P{self.i} failed to search {st, ends}')
+                        res = e
+                    self.done.put((self.i, job, st, ends, res))
+
+
+class SearchPool:
+    """
+    Long-lived `SearchProcess` workers shared by the searches of the app (see the lifespan hook in `main.py`), so
+    that no process is spawned per request. Rows are handed to the workers one at a time as they become idle.
+
+    A layout is registered once per plan (see `layout()`) and sent to a worker along with the first of its rows that
+    the worker gets: the passes of a plan (see `HamiltonianSearch.search()`) only send their rows.
+
+    Params:
+
+        `n` = None: Number of child processes (defaults to the number of cores)
+
+    Main Methods: `layout()`, `search_rows()`
+    """
+
+    def __init__(self, n: Optional[int] = None):
+        self.n = n or os.cpu_count() or 1
+        self.done = mp.Queue()  # (worker, job, r, [c, ...], [(cost, path), ...] or the exception raised) or None
+        self.inboxes = []
+        self.procs = []
+        self.jobs = count()
+        self.lock = threading.Lock()
+        # guarded by `lock`
+        self.results = {}  # job id -> queue.Queue of its results
+        self.layouts = {}  # layout id -> (astar, pos, algo_type)
+        self.pending = deque()  # (job, layout, r, [c, ...], epsilon, deadline) waiting for an idle worker
+        self.idle = []  # workers without a row
+        self.sent = []  # ids of the layouts every worker holds
+        self.dispatcher = None
+
+    def start(self):
+        for i in range(self.n):
+            inbox = mp.Queue()
+            p = SearchProcess(inbox, self.done, i)
+            p.daemon = True
+            p.start()
+            self.inboxes.append(inbox)
+            self.procs.append(p)
+            self.idle.append(i)
+            self.sent.append(set())
+
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+        return self
+
+    def _assign(self):
+        """Hands pending rows to idle workers (`lock` must be held)"""
+        while self.idle and self.pending:
+            i = self.idle.pop()
+            job, layout, *row = self.pending.popleft()
+            if layout not in self.sent[i]:
+                self.inboxes[i].put(('layout', layout, *self.layouts[layout]))
+                self.sent[i].add(layout)
+            self.inboxes[i].put(('row', job, layout, *row))
+
+    def _dispatch(self):
+        """Routes the results of the workers to the jobs waiting for them"""
+        while 1:
+            res = self.done.get()
+            if res is None:
+                return
+            i, job, *res = res
+            with self.lock:
+                self.idle.append(i)
+                self._assign()
+                results = self.results.get(job)
+            if results is not None:
+                results.put(res)
+
+    @contextmanager
+    def layout(
+        self,
+        astar: AStar,
+        pos: List["Position"],
+        algo_type: AlgoType
+    ):
+        """Registers a layout for `search_rows()` until the block exits, the workers that received it then drop it
+
+        Yields the id of the layout"""
+        layout = next(self.jobs)
+        with self.lock:
+            self.layouts[layout] = astar, pos, algo_type
+        try:
+            yield layout
+        finally:
+            with self.lock:
+                del self.layouts[layout]
+                for i, sent in enumerate(self.sent):
+                    if layout in sent:
+                        sent.discard(layout)
+                        self.inboxes[i].put(('drop', layout))
+
+    def search_rows(
+        self,
+        layout: int,
+        rows: List[Tuple[int, List[int]]],
+        epsilon: float = 1,
+        deadline: Optional[float] = None
+    ):
+        """Searches every row (r, [c, ...]) of an adjacency matrix of a layout registered by `layout()` (see
+        `AStar.search_many()` for `epsilon` and `deadline`)
+
+        Yields (r, [c, ...], [(cost, compact path or None), ...]) as the rows complete"""
+        job = next(self.jobs)
+        results = queue.Queue()
+        with self.lock:
+            self.results[job] = results
+            self.pending.extend((job, layout, r, cs, epsilon, deadline) for r, cs in rows)
+            self._assign()
+        try:
+            for _ in rows:
+                r, cs, fs = results.get()
+                if isinstance(fs, Exception):
+                    raise fs
+                yield r, cs, fs
+        finally:
+            with self.lock:
+                del self.results[job]
+                self.pending = deque(row for row in self.pending if row[0] != job)
+
+    def close(self):
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for p in self.procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+        self.done.put(None)
+        if self.dispatcher is not None:
+            self.dispatcher.join()
+        self.procs = []
+        self.inboxes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 class HamiltonianSearch:
     """
     Uses `Astar` (If AlgoType.EXHAUSIVE_ASTAR) to do an exhaustive search on all possible permutations of order of obstacles to visit 
     and finds the lowest cost permutation and its associated paths.
+    With AlgoType.DUBINS, the permutation is chosen on Dubins path estimates instead (see `_dubins_edges()`), and only
+    its legs are searched with `Astar`. With AlgoType.HYBRID_ASTAR, the searches are run by `HybridAStar`.
 
-    Uses Multiprocessing (parameter `n` which defaults to 8) to lower computation time.
+    Uses Multiprocessing (the app's `SearchPool`, or a temporary one of `n` processes) to lower computation time.
 
     Params:
 
         `map`: Map object
         `src`: Position object of the source/starting position
-        `n` = 8: Number of child processes to run concurrently
+        `algo_type`: AlgoType
+        `n` = 8: Number of child processes to run concurrently, if no `pool` is given
+        `pool` = None: long-lived SearchPool to run the searches on
+        `epsilon` = 1: weight of the heuristic of the A* searches (weighted A*), the plan costs at most `epsilon`
+            times the lowest cost but takes fewer expansions to find
+        `deadline` = None: `time.time()` by which to return, every search (of the edges and of the legs of the
+            tour) stops at it and `search()` raises `SearchTimeout` if no plan was found by then. With
+            AlgoType.EXHAUSTIVE_ASTAR, the search is then anytime: a first plan is found with higher weights
+            (`ANYTIME_EPSILONS`), then improved with lower weights, down to `epsilon`, while the deadline allows
+        `on_leg` = None: called with (location, path) for every leg of the plan as soon as it is found (from the
+            thread running `search()`). The plan is then the first tour found: the order of the best tour by the
+            edges is kept (skipping the locations whose leg cannot be found), and there is a single pass
 
     Main Method: `search()`
         
         Returns:
             min_perm`: lowest cost order of visiting all the obstacles starting from starting location;
             `loc_mn_path`: An array of a path Array of `Node` where each inner path Array is the path from one location to another;
+
+        The obstacles found unreachable (up front, or as no leg to them was found) are left out of `min_perm` and
+        listed in `dropped`, and the cost of the plan is within `bound` times the lowest one.
+
+    Progress (read from another thread while it runs): `edges_done` out of `edges_total` edges of the current pass
+    found, and `best_cost` of the best plan so far. `cancel()` stops the search at the next row or leg.
     """
 
     def __init__(
@@ -156,74 +396,185 @@ class HamiltonianSearch:
         map: "Map", 
         src: "Position",
         algo_type: AlgoType,
-        n: int = 8
+        n: int = 8,
+        pool: Optional[SearchPool] = None,
+        epsilon: float = 1,
+        deadline: Optional[float] = None,
+        on_leg: Optional[Callable[[int, List["Node"]], None]] = None
     ):
-        self.astar = AStar(map)
+        self.astar = HybridAStar(map) if algo_type == AlgoType.HYBRID_ASTAR else AStar(map)
         self.src = src
         self.pos = [src] + [o.to_pos() for o in map.obstacles]
         self.n = n
+        self.pool = pool
+        self.legs = {}  # (r, c) -> compact path found by the edge phase (None if it found none)
         self.algo_type = algo_type
+        self.dropped = []  # locations left out of the tour: unreachable before the search, or no leg to them found
+        self.epsilon = epsilon
+        self.deadline = deadline
+        self.bound = None  # suboptimality bound of the plan found (weight of the last complete A* pass)
+        self.edges_done = 0
+        self.edges_total = 0
+        self.best_cost = None
+        self.cancelled = threading.Event()
+        self.on_leg = on_leg
 
         # TODO: BFS
         if algo_type == AlgoType.BFS:
             raise NotImplementedError()
 
     
-    def search(self, top_n: int = 3):
-        print("----- Start Hamiltonian Search -----")
-
-        st = time.time()
+    def _leg(
+        self,
+        st: "Position",
+        r: int,
+        c: int,
+        epsilon: float = 1,
+        deadline: Optional[float] = None
+    ) -> List["Node"]:
+        """Path from `st` (where the previous leg ended) to location `c`: the leg found by the edge phase from
+        location `r` if it can be followed from `st`, else a new search, stopped at `deadline` (none if the edge
+        phase found no path)"""
+        if (r, c) in self.legs:
+            if self.legs[r, c] is None:
+                return []
+            segment = self.astar.replay(st, self.pos[c], self.legs[r, c][1])
+            if segment:
+                return segment
+            logger.info(f'Leg {r} -> {c} cannot be followed from {st}, searching again')
+        if euclidean(st, self.pos[c]) >= BIDIRECTIONAL_MIN_DIST:
+            return self.astar.search_bidirectional(st, self.pos[c], epsilon, deadline)
+        return self.astar.search(st, self.pos[c], epsilon, deadline)
+
+    def _unreachable(self) -> List[int]:
+        """Locations that no path can reach, found without searching: every pose of the goal region is out of the
+        arena, or the start cannot reach the goal even on the relaxed lattice of the goal's heuristic field (which
+        also computes the field of every reachable goal, to be shipped to the child processes with `self.astar`)"""
+        unreachable = []
+        k = self.src.to_lattice()
+        for i, pos in enumerate(self.pos[1:], 1):
+            if not self._in_arena(pos):
+                logger.info(f'Location {i} {pos} is out of the arena')
+                unreachable.append(i)
+            elif 0 <= k[0] < LATTICE_X and 0 <= k[1] < LATTICE_Y and self.astar.heuristic_field(pos)[k] == math.inf:
+                logger.info(f'Location {i} {pos} cannot be reached from {self.src}')
+                unreachable.append(i)
+        return unreachable
+
+    def _in_arena(self, pos: "Position") -> bool:
+        """Whether some pose that reaches the goal at `pos` (within the tolerances of `Goal.reached()`) is within
+        the arena. The goal region is sampled every cm and every 5 degrees, a sample standing for the poses up to
+        half a cm away from it (see `Map.is_valid_batch()`)"""
+        x_bounds, y_bounds = AStar._bounds(pos)
+        if x_bounds[0] > x_bounds[1] or y_bounds[0] > y_bounds[1]:
+            return False
+        xs = np.linspace(*x_bounds, math.ceil(x_bounds[1] - x_bounds[0]) + 1)
+        ys = np.linspace(*y_bounds, math.ceil(y_bounds[1] - y_bounds[0]) + 1)
+        thetas = pos.theta + np.linspace(-MAX_THETA_ERR, MAX_THETA_ERR, 7)
+        poses = np.stack(np.meshgrid(xs, ys, thetas), axis=-1).reshape(-1, 3)
+        return bool(self.astar.map.is_valid_batch(poses, [], margin=-0.5).any())
+
+    def _edges(
+        self,
+        pool: SearchPool,
+        layout: int,
+        rows: List[Tuple[int, List[int]]],
+        epsilon: float,
+        deadline: Optional[float]
+    ) -> List[List[float]]:
+        """Adjacency matrix of the costs between locations (`MAX_ASTAR_F_COST` if unreachable), the legs found are
+        kept in `self.legs`"""
         n = len(self.pos)
-        m = int(n*n - n - (n-1)) # total paths to calc from pt to pt (excluding from pt_a to pt_a and from pt_a to 0)
-        perms = _permutate(n, True)
-        edges = [[0 for _ in range(n)] for _ in range(n)]
-        todo = mp.Queue() # (r, c)
-        done = mp.Queue() # (r, c, astar f cost)
-
-        for r in range(n):
-            for c in range(n):
-                if r != c and c != 0:
-                    todo.put((r, c))
-
-        # Create multiple Threads/Process and starts them
-        for i in range(self.n):
-            p = SearchProcess(self.pos, self.astar, todo, done, i, self.algo_type)
-            p.daemon = True
-            p.start()
-
-        while m:
-            r, c, f = done.get()
-            edges[r][c] = f
-            logger.info(f'{r} -> {c} ({f})')
-            m -= 1
-        logger.info(f'Adj list completed in {time.time()-st} s')
-        print(f'Adj list completed in {time.time()-st} s')
-
-        # get shortest path, i.e., lowest cost among all permutations
-        st2 = time.time()
-        h = []
-        for i, perm in enumerate(perms):
-            cost = sum([edges[perm[i]][perm[i+1]] for i in range(n-1)])
-            heapq.heappush(h, (cost, perm))
+        edges = [[MAX_ASTAR_F_COST for _ in range(n)] for _ in range(n)]
+        legs = {}
+        for r, cs, res in pool.search_rows(layout, rows, epsilon, deadline):
+            self._check_cancelled()
+            self.edges_done += len(cs)
+            for c, (f, leg) in zip(cs, res):
+                edges[r][c] = f
+                if self.algo_type in (AlgoType.EXHAUSTIVE_ASTAR, AlgoType.HYBRID_ASTAR):
+                    legs[r, c] = leg
+                logger.info(f'{r} -> {c} ({f})')
+        self.legs = legs
+        return edges
+
+    def _dubins_edges(self, locs: List[int]) -> List[List[float]]:
+        """Adjacency matrix of the costs between `locs` estimated without searching (`MAX_ASTAR_F_COST` if
+        unknown): the cheapest collision-free Dubins path, driven forward or backward, costed like the motion
+        primitives (see `primitive_costs()`). If every path collides, the cheapest one times `DUBINS_BLOCKED_FACTOR`.
+        No leg is kept: only the legs of the chosen tour are searched, by `_leg()`"""
+        n = len(locs)
+        poses = np.array([[self.pos[i].x, self.pos[i].y, self.pos[i].theta] for i in locs])
+        st = np.repeat(poses, n, axis=0)
+        end = np.tile(poses, (n, 1))
+
+        # The robot views an obstacle from within its virtual boundary: a path is not checked against the
+        # obstacles viewed at its ends
+        viewed = np.array([[i == j for j in range(1, len(self.pos))] for i in locs]).reshape(n, -1)
+        checked = ~(np.repeat(viewed, n, axis=0) | np.tile(viewed, (n, 1)))
+
+        clear = np.full(n * n, np.inf)
+        cheapest = np.full(n * n, np.inf)
+        for reverse in (False, True):
+            turn = np.array([0, 0, math.pi if reverse else 0])
+            sol = dubins_batch(st + turn, end + turn)
+            costs = primitive_costs(sol, reverse)
+            ok = clear_paths(sol, st + turn, self.astar.map, reverse, checked)
+            clear = np.minimum(clear, np.where(ok, costs, np.inf).min(axis=-1))
+            cheapest = np.minimum(cheapest, costs.min(axis=-1))
+        est = np.where(np.isfinite(clear), clear, cheapest * DUBINS_BLOCKED_FACTOR).reshape(n, n)
+
+        edges = [[MAX_ASTAR_F_COST for _ in range(len(self.pos))] for _ in range(len(self.pos))]
+        for a, r in enumerate(locs):
+            for b, c in enumerate(locs):
+                if c not in (0, r) and np.isfinite(est[a, b]):
+                    edges[r][c] = float(est[a, b])
+                    logger.info(f'{r} -> {c} ({edges[r][c]})')
+        self.legs = {}
+        self.edges_done = self.edges_total
+        return edges
+
+    def _tour(
+        self,
+        edges: List[List[float]],
+        locs: List[int],
+        top_n: int,
+        epsilon: float
+    ) -> Tuple[float, List[int], List[List["Node"]]]:
+        """Lowest cost order of visiting `locs` (among the `top_n` best by `edges`) and its paths. The locations
+        whose leg cannot be found are left out of the order (and cost `MAX_ASTAR_F_COST` each), so that the paths
+        are those of the legs to the locations of the order after the start"""
+        tours = [
+            (cost, [locs[i] for i in perm])
+            for cost, perm in held_karp([[edges[r][c] for c in locs] for r in locs], top_n)
+        ]
+
+        if self.on_leg is not None:
+            # the legs are handed out as they are found, the order cannot change anymore
+            tours = tours[:1]
 
         loc_mn_path = []
         loc_mn_f = float('inf')
         min_perm = []
-        for _ in range(min(top_n, len(h))):
+        for cost, perm in tours:
 
             path = []
+            visited = perm[:1]
             prev = self.pos[0]
-            cost, perm = heapq.heappop(h)
             f = 0
             logger.info(f'Calculating path for {perm}')
 
-            for i in range(1, n):
-                segment = self.astar.search(prev, self.pos[perm[i]])
+            for i in range(1, len(perm)):
+                self._check_cancelled()
+                segment = self._leg(prev, perm[i-1], perm[i], epsilon, self.deadline)
 
                 if segment:
                     path.append(segment)
+                    visited.append(perm[i])
                     prev = segment[-1].c_pos
                     f += segment[-1].f
+                    if self.on_leg is not None:
+                        self.on_leg(perm[i], segment)
                 else:
                     f += MAX_ASTAR_F_COST
 
@@ -233,13 +584,83 @@ class HamiltonianSearch:
             if f < loc_mn_f:
                 loc_mn_f = f
                 loc_mn_path = path
-                min_perm = perm
+                min_perm = visited
             if f < MAX_ASTAR_F_COST:
-                print("f < MAX_ASTAR_F_COST")
-                print(f'Time (pathfinding) {time.time()-st2} s')
-                print(f'Total runtime {time.time()-st} s')
-                return perm, path
-        
-        print(f'Time (pathfinding) {time.time()-st2} s')
+                logger.debug(f"Tour of cost {f} visits every location it could reach")
+                return f, visited, path
+
+        return loc_mn_f, min_perm, loc_mn_path
+
+    def cancel(self):
+        """Stops the search (possibly from another thread), `search()` raises `SearchCancelled`"""
+        self.cancelled.set()
+
+    def _check_cancelled(self):
+        if self.cancelled.is_set():
+            raise SearchCancelled('Search cancelled')
+
+    def search(self, top_n: int = 3):
+        print("----- Start Hamiltonian Search -----")
+
+        st = time.time()
+        n = len(self.pos)
+
+        # The obstacle-aware heuristic of every goal is computed once here and shipped to the child processes
+        # along with `self.astar`, instead of once per process. Goals found unreachable on the way are dropped
+        searched = self.algo_type in (AlgoType.EXHAUSTIVE_ASTAR, AlgoType.HYBRID_ASTAR, AlgoType.DUBINS)
+        self.dropped = self._unreachable() if searched else []
+        locs = [i for i in range(n) if i not in self.dropped]
+        if locs == [0]:
+            logger.info('No location to visit')
+            return [0], []
+
+        # (r, [c, ...]), a row of the adjacency matrix is searched in a single sweep
+        rows = [(r, [c for c in locs if c not in (0, r)]) for r in locs]
+
+        # Anytime search: the passes with lower weights are only kept if they complete before the deadline, the
+        # search times out if the first one does not
+        anytime = self.deadline is not None and self.algo_type == AlgoType.EXHAUSTIVE_ASTAR and self.on_leg is None
+        epsilons = [e for e in ANYTIME_EPSILONS if e > self.epsilon] if anytime else []
+        epsilons.append(self.epsilon)
+        best = None
+
+        # Runs the rows on the long-lived pool if there is one, else on a temporary pool (stopped once done). The
+        # Dubins estimates are computed in this process. The layout is sent to the workers once, for every pass
+        pooled = self.algo_type != AlgoType.DUBINS
+        temporary = self.pool is None and pooled
+        with SearchPool(min(self.n, n)) if temporary else nullcontext(self.pool) as pool, \
+                pool.layout(self.astar, self.pos, self.algo_type) if pooled else nullcontext() as layout:
+            for epsilon in epsilons:
+                st2 = time.time()
+                self._check_cancelled()
+                self.edges_done, self.edges_total = 0, sum(len(cs) for _, cs in rows)
+                try:
+                    if self.algo_type == AlgoType.DUBINS:
+                        edges = self._dubins_edges(locs)
+                    else:
+                        edges = self._edges(pool, layout, rows, epsilon, self.deadline)
+                    logger.info(f'Adj list completed in {time.time()-st2} s')
+                    print(f'Adj list completed in {time.time()-st2} s')
+
+                    # get shortest path, i.e., lowest cost among all permutations
+                    st2 = time.time()
+                    plan = self._tour(edges, locs, top_n, epsilon)
+                    print(f'Time (pathfinding) {time.time()-st2} s')
+                except SearchTimeout:
+                    if best is None:
+                        raise SearchTimeout('No plan found before the deadline')
+                    logger.info(f'Deadline reached, keeping the plan within {self.bound} of the lowest cost')
+                    break
+
+                if self.algo_type == AlgoType.EXHAUSTIVE_ASTAR:
+                    self.bound = epsilon
+                if best is None or plan[0] < best[0]:
+                    best = plan
+                    self.best_cost = plan[0]
+                if self.deadline is not None and time.time() > self.deadline:
+                    break
+
         print(f'Total runtime {time.time()-st} s')
-        return min_perm, loc_mn_path # AlgoOutput -> `min_perm`: lowest cost order of visiting all the obstacles starting from starting location; `loc_mn_path`: An array of a path Array of `Node` where each inner path Array is the path from one location to another
\ No newline at end of file
+        _, min_perm, loc_mn_path = best
+        self.dropped += [loc for loc in locs if loc not in min_perm]
+        return min_perm, loc_mn_path # AlgoOutput -> `min_perm`: lowest cost order of visiting all the obstacles starting from starting location; `loc_mn_path`: An array of a path Array of `Node` where each inner path Array is the path from one location to another
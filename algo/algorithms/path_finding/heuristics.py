@@ -0,0 +1,245 @@
+import hashlib
+import logging
+import math
+import os
+from typing import Optional, Sequence
+
+import numpy as np
+
+from common.consts import (
+    LATTICE_THETA,
+    LATTICE_X,
+    LATTICE_Y,
+    MAP_HEIGHT,
+    MAP_WIDTH,
+    MAX_THETA_ERR,
+    MAX_X_ERR,
+    MAX_Y_ERR,
+    PENALTY_STOP,
+    SNAP_COORD,
+)
+from robot.move import MOTIONS, PRIMITIVE_DX, PRIMITIVE_DY, PRIMITIVE_HEADING, heading_to_theta
+
+
+logger = logging.getLogger('HEURISTICS')
+
+
+def _landing_index() -> np.ndarray:
+    """Where every move of every lattice state can land, as indices into the stacked minimum filters of a field
+    (see `goal_distance_field`): a continuous position is within half a cell of its snapped cell, so a displacement
+    of `a` cells lands `floor(a)` or `ceil(a)` cells away (exactly `a` cells if it is integral)
+
+    Returns:
+        (len(MOTIONS), LATTICE_X, LATTICE_Y, LATTICE_THETA) int array, `_SENTINEL` for the moves leaving the lattice
+    """
+    index = np.full((len(MOTIONS), LATTICE_X, LATTICE_Y, LATTICE_THETA), _SENTINEL)
+    x, y = np.meshgrid(np.arange(LATTICE_X), np.arange(LATTICE_Y), indexing='ij')
+    for h in range(LATTICE_THETA):
+        for code in range(len(MOTIONS)):
+            ax, ay = PRIMITIVE_DX[h, code] / SNAP_COORD, PRIMITIVE_DY[h, code] / SNAP_COORD
+            # filters: 0 -> the cell itself, 1 -> 2 cells along x, 2 -> 2 cells along y, 3 -> 2 by 2 cells
+            span_x, span_y = abs(ax - round(ax)) >= 1e-6, abs(ay - round(ay)) >= 1e-6
+            tx = x + math.floor(ax + 1e-6)
+            ty = y + math.floor(ay + 1e-6)
+            inside = (tx >= 0) & (tx < LATTICE_X) & (ty >= 0) & (ty < LATTICE_Y)
+            flat = np.ravel_multi_index(
+                (np.full_like(tx, span_x + 2*span_y), tx.clip(0, LATTICE_X - 1), ty.clip(0, LATTICE_Y - 1),
+                 np.full_like(tx, PRIMITIVE_HEADING[h, code])),
+                (4, LATTICE_X, LATTICE_Y, LATTICE_THETA)
+            )
+            index[code, :, :, h] = np.where(inside, flat, _SENTINEL)
+    return index
+
+
+_SENTINEL = 4 * LATTICE_X * LATTICE_Y * LATTICE_THETA  # index of an `inf` appended to the filters
+_LANDING = _landing_index()
+_DIST = np.array([m[2] for m in MOTIONS])[:, None, None, None]
+
+
+def goal_distance_field(
+    valid_moves: np.ndarray,
+    x_bounds: Sequence[float],
+    y_bounds: Sequence[float],
+    end_theta: float
+) -> np.ndarray:
+    """Cost-to-go from every lattice state to a goal, on the layout's move table
+
+    A relaxation of the A* search graph: a state is a snapped cell and heading, its moves are the ones allowed by
+    `valid_moves` and a move may land on any cell around the primitive's offset (a continuous position drifts by
+    up to half a cell from its snapped cell, exact rounding ties aside). Stopping penalties are ignored. Every path
+    of the search is also a path of the relaxation, so the field never overestimates the distance driven to the goal, while still routing
+    around obstacles and accounting for the turns needed to reach the goal heading.
+
+    Params:
+        `valid_moves`: (LATTICE_X, LATTICE_Y, LATTICE_THETA, len(MOTIONS)) table of the moves valid from some pose
+            of each cell, see `Map.cell_valid_moves()`
+        `x_bounds`, `y_bounds`: goal region of the search, see `AStar._set_bounds()`
+        `end_theta`: goal direction
+
+    Returns:
+        (LATTICE_X, LATTICE_Y, LATTICE_THETA) float array, `inf` for the states that cannot reach the goal
+    """
+    field = np.full((LATTICE_X, LATTICE_Y, LATTICE_THETA), np.inf)
+
+    # seed every state from which a continuous position within the cell can pass the goal check
+    x0 = max(0, math.ceil((x_bounds[0] - SNAP_COORD / 2) / SNAP_COORD))
+    x1 = min(LATTICE_X - 1, math.floor((x_bounds[1] + SNAP_COORD / 2) / SNAP_COORD))
+    y0 = max(0, math.ceil((y_bounds[0] - SNAP_COORD / 2) / SNAP_COORD))
+    y1 = min(LATTICE_Y - 1, math.floor((y_bounds[1] + SNAP_COORD / 2) / SNAP_COORD))
+    for h in range(LATTICE_THETA):
+        if abs(end_theta - heading_to_theta(h)) % (2*math.pi) <= MAX_THETA_ERR:
+            field[x0:x1 + 1, y0:y1 + 1, h] = 0
+
+    # Bellman-Ford sweeps until the field is stable (one sweep per move of the longest shortest path)
+    invalid = ~np.moveaxis(valid_moves, -1, 0)
+    padded = np.full((LATTICE_X + 1, LATTICE_Y + 1, LATTICE_THETA), np.inf)
+    while True:
+        # minimum of the field over the cells a move can land on, with the layout of `_landing_index()`
+        padded[:-1, :-1] = field
+        along_x = np.minimum(field, padded[1:, :-1])
+        along_y = np.minimum(field, padded[:-1, 1:])
+        both = np.minimum(along_x, np.minimum(padded[:-1, 1:], padded[1:, 1:]))
+        landing = np.concatenate([field.ravel(), along_x.ravel(), along_y.ravel(), both.ravel(), [np.inf]])
+
+        cost = _DIST + landing[_LANDING]
+        cost[invalid] = np.inf
+        nxt = np.minimum(field, np.minimum.reduce(cost))
+
+        if np.array_equal(nxt, field):
+            return field
+        field = nxt
+
+
+# +------------------------------------------+
+# | obstacle-free cost-to-go (lookup table)  |
+# +------------------------------------------+
+
+# Half-size (in cells) of the table: no two positions on the map are further apart than this
+CTG_RADIUS = math.ceil(math.hypot(MAP_WIDTH, MAP_HEIGHT) / SNAP_COORD) + 2
+CTG_UNREACHABLE = np.iinfo(np.uint16).max
+
+
+def _ctg_fingerprint() -> str:
+    """Short hash of everything the table depends on, so that a table built for another calibration profile
+    (or after tuning the primitives) is never loaded"""
+    key = repr((MOTIONS, PRIMITIVE_DX.round(6).tolist(), PRIMITIVE_DY.round(6).tolist(), PENALTY_STOP,
+                MAX_X_ERR, MAX_Y_ERR, MAX_THETA_ERR, SNAP_COORD, LATTICE_THETA, CTG_RADIUS))
+    return hashlib.sha1(key.encode()).hexdigest()[:10]
+
+
+CTG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', f'cost_to_go_{_ctg_fingerprint()}.npy')
+
+
+def build_cost_to_go_table() -> np.ndarray:
+    """Cost-to-go of the motion primitives on an empty map, relative to the robot's pose (computed offline)
+
+    The robot starts at the centre cell with heading 0 and its first move is free of `PENALTY_STOP` (the previous
+    move of a node is not part of the lookup). As in `goal_distance_field`, a move may land on either cell its
+    continuous end point can round to, so the costs are lower bounds for any position within the start cell.
+
+    Returns:
+        (2*CTG_RADIUS+1, 2*CTG_RADIUS+1, LATTICE_THETA) uint16 array, indexed by the floored cell offset of the goal
+        (in the robot's frame, shifted by CTG_RADIUS) and its heading relative to the robot: the lowest cost to pass
+        the goal check of a goal within that cell, rounded down. `CTG_UNREACHABLE` if it cannot be passed
+    """
+    n = 2*CTG_RADIUS + 1
+    dist = np.full((len(MOTIONS), n, n, LATTICE_THETA), np.inf)  # by the motion code of the last move
+    start = np.full((n, n, LATTICE_THETA), np.inf)
+    start[CTG_RADIUS, CTG_RADIUS, 0] = 0
+
+    moves = []
+    for code, (_, _, d, *_) in enumerate(MOTIONS):
+        for h in range(LATTICE_THETA):
+            a = PRIMITIVE_DX[h, code] / SNAP_COORD, PRIMITIVE_DY[h, code] / SNAP_COORD
+            lo = [math.floor(v + 1e-6) for v in a]
+            span = [int(abs(v - round(v)) >= 1e-6) for v in a]
+            moves.append((code, d, h, PRIMITIVE_HEADING[h, code], lo, span))
+
+    # Bellman-Ford sweeps (pulling into every state from the states a move can come from)
+    while True:
+        best = np.minimum(np.minimum.reduce(dist), start) + PENALTY_STOP
+        nxt = dist.copy()
+        for code in range(len(MOTIONS)):
+            src = np.minimum(np.minimum(dist[code], start), best)
+            # src_min[(span_x, span_y)][c] = min of src over the cells c - (0..span_x, 0..span_y)
+            padded = np.full((n + 1, n + 1, LATTICE_THETA), np.inf)
+            padded[1:, 1:] = src
+            src_min = {(0, 0): src, (1, 0): np.minimum(src, padded[:-1, 1:]), (0, 1): np.minimum(src, padded[1:, :-1])}
+            src_min[(1, 1)] = np.minimum(src_min[(1, 0)], np.minimum(padded[1:, :-1], padded[:-1, :-1]))
+
+            for c, d, h, new_h, (lx, ly), span in moves:
+                if c != code:
+                    continue
+                # target t comes from t - lo (- 1 along the axes where the landing cell is ambiguous)
+                window = src_min[tuple(span)]
+                tx0, tx1 = max(0, lx), min(n, n + lx)
+                ty0, ty1 = max(0, ly), min(n, n + ly)
+                cost = d + window[tx0 - lx:tx1 - lx, ty0 - ly:ty1 - ly, h]
+                np.minimum(nxt[code, tx0:tx1, ty0:ty1, new_h], cost, out=nxt[code, tx0:tx1, ty0:ty1, new_h])
+
+        if np.array_equal(nxt, dist):
+            break
+        dist = nxt
+    reached = np.minimum(np.minimum.reduce(dist), start)
+
+    # A goal whose centre is in cell f can be passed from the cells within reach of its goal region (plus the half
+    # cell of rounding), with a heading within MAX_THETA_ERR of its own
+    reach = int((math.hypot(max(MAX_X_ERR), max(MAX_Y_ERR)) + SNAP_COORD / 2) / SNAP_COORD)
+    dh = int(round(MAX_THETA_ERR / (2*math.pi) * LATTICE_THETA))
+    padded = np.full((n + 2*reach + 1, n + 2*reach + 1, LATTICE_THETA), np.inf)
+    padded[reach:reach + n, reach:reach + n] = reached
+    table = np.full((n, n, LATTICE_THETA), np.inf)
+    for ox in range(2*reach + 2):
+        for oy in range(2*reach + 2):
+            np.minimum(table, padded[ox:ox + n, oy:oy + n], out=table)
+    table = np.minimum.reduce([np.roll(table, r, axis=2) for r in range(-dh, dh + 1)])
+
+    return np.where(np.isfinite(table), np.floor(table), CTG_UNREACHABLE).astype(np.uint16)
+
+
+def load_cost_to_go_table(path: str = CTG_PATH) -> Optional[np.ndarray]:
+    """Loads the table built by `python -m path_finding.heuristics`, None (and a warning) if it is missing"""
+    if not os.path.exists(path):
+        logger.warning(f'No cost-to-go table at {path}, run `python -m path_finding.heuristics` to build it')
+        return None
+    return np.load(path)
+
+
+# Loaded once at import for the calibration profile selected in `common/consts.py`
+COST_TO_GO = load_cost_to_go_table()
+_COS = np.cos(heading_to_theta(np.arange(LATTICE_THETA))).tolist()
+_SIN = np.sin(heading_to_theta(np.arange(LATTICE_THETA))).tolist()
+
+
+def cost_to_go(
+    x: float,
+    y: float,
+    heading: int,
+    end_x: float,
+    end_y: float,
+    end_heading: int
+) -> float:
+    """Obstacle-free cost-to-go from a pose (with a lattice heading) to a goal, looked up in `COST_TO_GO`
+
+    Returns:
+        a lower bound of the cost, 0 if there is no table or the goal is out of its range, `inf` if the goal
+        cannot be reached"""
+    if COST_TO_GO is None:
+        return 0
+
+    # goal offset in the robot's frame
+    ex, ey = end_x - x, end_y - y
+    c, s = _COS[heading], _SIN[heading]
+    ix = math.floor((c*ex + s*ey) / SNAP_COORD) + CTG_RADIUS
+    iy = math.floor((c*ey - s*ex) / SNAP_COORD) + CTG_RADIUS
+    if not (0 <= ix < COST_TO_GO.shape[0] and 0 <= iy < COST_TO_GO.shape[1]):
+        return 0
+
+    cost = COST_TO_GO[ix, iy, (end_heading - heading) % LATTICE_THETA]
+    return math.inf if cost == CTG_UNREACHABLE else float(cost)
+
+
+if __name__ == '__main__':
+    os.makedirs(os.path.dirname(CTG_PATH), exist_ok=True)
+    np.save(CTG_PATH, build_cost_to_go_table())
+    print(f'Saved {CTG_PATH}')
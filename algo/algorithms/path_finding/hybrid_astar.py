@@ -1,183 +1,118 @@
 import logging
-import heapq
+import math
+from math import pi
 from typing import List, Optional
 
-from arena.map import Map
 from common.consts import (
     PENALTY_STOP,
-    ROBOT_TIME_STEP
+    LATTICE_THETA,
+    LATTICE_X,
+    LATTICE_Y,
+    SNAP_COORD
 )
-from common.enums import Movement
 from common.types import Position
-from common.utils import euclidean
 from robot.move import (
+    PRIMITIVES,
     bwd,
     bwd_left,
     bwd_right,
     fwd,
     fwd_left,
-    fwd_right
+    fwd_right,
+    heading_to_theta
 )
-from path_finding.path_validation import has_collision
+from path_finding.astar import SHOT_EVERY, AStar, Goal, Node
 
 
 logger = logging.getLogger('HYBRID A*')
 
+# Move of the robot from a continuous pose, by motion code (see `MOTIONS`)
+MOVES = (fwd, fwd_left, fwd_right, bwd, bwd_left, bwd_right)
 
-class Node:
 
-    def __init__(
-        self,
-        pos: Position,
-        c_pos: Position,
-        g: float,
-        h: float,
-        parent: Optional["Node"] = None,
-        v: Optional[int] = 1,
-        s: Optional[int] = 0
-    ):
-        self.pos = pos
-        self.c_pos = c_pos  # pos in continuous scale
-        self.g = g  # st to curr
-        self.h = h  # curr to end
-        self.f = g + h  # total
+class HybridAStar(AStar):
+    """
+    Hybrid A*: `AStar` over continuous poses
 
-        self.v = v  # prev motion's vert direction, -1: bwd, 1: fwd
-        self.s = s  # prev motion's steering direction, -1: left, 0: straight, 1: fwd
+    Every node keeps the exact pose its moves lead to, heading included (`AStar` moves along the lattice headings),
+    and is binned into the lattice cell of that pose only to be closed, in a set. The moves are checked for
+    collisions from the exact poses instead of being looked up in the move table of the snapped cells, and the
+    search shoots at the goals every `SHOT_EVERY` pops (analytic expansion), taking the first shot clear of obstacles.
+    The costs found are then not bounded by `epsilon`.
 
-        self.parent = parent
+    The paths are made of the same motion primitives as those of `AStar` and are compacted and replayed the same way.
+    """
 
-    def __eq__(
-        self,
-        node: "Node"
-    ) -> bool:
-        return self.pos.x == node.pos.x and \
-            self.pos.y == node.pos.y and \
-            self.pos.theta == node.pos.theta
+    closed_set = set
 
-    def __lt__(
+    def _valid(
         self,
         node: "Node"
-    ) -> bool:
-        # custom comparator for heapq
-        return self.f < node.f
-
-    def __str__(self) -> str:
-        return f'Node(x:{self.pos.x:6.2f}, y:{self.pos.y:6.2f}, θ:{self.pos.theta:6.2f}, g:{self.g:6.2f}, h:{self.h:6.2f}, f:{self.f:6.2f})'
-
-
-movements = {
-    (1, -1): Movement.FWD_LEFT,
-    (1, 0): Movement.FWD,
-    (1, 1): Movement.FWD_RIGHT,
-    (-1, -1): Movement.BWD_LEFT,
-    (-1, 0): Movement.BWD,
-    (-1, 1): Movement.BWD_RIGHT
-}
-
-
-class HybridAStar:
-
-    def __init__(
-        self,
-        map: "Map"
     ):
-        self.map = map
-        self.st = None
-        self.end = None
-
-        self.open = []
-        self.open_h = {}
+        # checked from the exact pose, there is no move table of continuous poses
+        return self.map.valid_moves_at(node.c_pos)
 
-        # fwd/bwd, left/straight/right, func
-        self.comb = ((1, -1, fwd_left),   # 45-degree forward left
-                     (1,  0, fwd),          # straight forward
-                     (1,  1, fwd_right),    # 45-degree forward right
-                     (-1, -1, bwd_left),     # 45-degree backward left
-                     (-1,  0, bwd),          # straight backward
-                     (-1,  1, bwd_right))    # 45-degree backward right
+    def _child(
+        self,
+        node: "Node",
+        primitive: tuple
+    ) -> "Node":
+        # the move of a motion primitive from the exact pose of `node`, binned into the lattice
+        code, v, s, d, *_ = primitive
+        nxt_pos = MOVES[code](node.c_pos)
+        nxt_pos.theta %= 2 * pi
+        k = (
+            int(round(nxt_pos.x / SNAP_COORD)),
+            int(round(nxt_pos.y / SNAP_COORD)),
+            int(round(nxt_pos.theta / (2 * pi) * LATTICE_THETA)) % LATTICE_THETA
+        )
+        h = self._h(nxt_pos, k) if 0 <= k[0] < LATTICE_X and 0 <= k[1] < LATTICE_Y else math.inf
+
+        penalty = 0
+        if v != node.v or s != node.s:
+            penalty = PENALTY_STOP
+
+        return Node(Position(k[0] * SNAP_COORD, k[1] * SNAP_COORD, heading_to_theta(k[2])), nxt_pos,
+                    node.g + penalty + d, h, node, v, s, d, k)
 
     def _expand(
         self,
-        node: "Node"
+        node: "Node",
     ):
-        p_pos = node.c_pos  # parent pos
+        valid = self._valid(node)
 
-        for v, s, f in self.comb:
-            # don't undo prev move
-            if node.v * v == -1 and node.s == s:
+        for primitive in PRIMITIVES[node.k[2]]:
+            if not valid[primitive[0]]:
                 continue
 
-            c_pos = f(p_pos)  # continuous pos
-
-            if not self.map.is_valid(c_pos):
+            nxt_node = self._child(node, primitive)
+            if nxt_node.k in self.closed or nxt_node.h == math.inf:
                 continue
 
-            if has_collision(node.c_pos, ROBOT_TIME_STEP, movements[(v, s)], self.map):
-                continue
+            # replaces (lazily) the open entry of the cell if this is a shorter way to reach it
+            self.open.push(nxt_node.k, nxt_node, nxt_node.g + self.epsilon * nxt_node.h, nxt_node.h)
 
-            g = ROBOT_TIME_STEP * \
-                (PENALTY_STOP if (v != node.v or s != node.s) else 1)
-            h = euclidean(self.end.pos, p_pos)
-            s_pos = c_pos.snap()  # snapped pos
-            s_pos_tup = s_pos.to_tuple()
-            cell = Node(s_pos, c_pos, node.g + g, h, node, v, s)
-
-            if self.open_h.get(s_pos_tup, -1) > cell.f:
-                for i, br in enumerate(self.open):
-                    if br == cell:
-                        # replace br with cell
-                        br.f = -1
-                        heapq._siftdown(self.open, 0, i)
-                        heapq.heappop(self.open)
-                        break
-
-            heapq.heappush(self.open, cell)
-            self.open_h[s_pos_tup] = cell.f
-
-    def _reconstruct(
+    def _shoots(
         self,
-        last: "Node"
-    ) -> List["Node"]:
-        res = []
-
-        while last:
-            res.append(last)
-            last = last.parent
+        epsilon: float
+    ) -> bool:
+        return self.open.pops % SHOT_EVERY == 1
 
-        return res[::-1]
+    def _shot_bound(
+        self,
+        node: "Node",
+        goal: Goal,
+        epsilon: float
+    ) -> float:
+        return math.inf
 
-    def search(
+    def search_bidirectional(
         self,
-        st: Position,
-        end: Position
+        st: "Position",
+        end: "Position",
+        epsilon: float = 1,
+        deadline: Optional[float] = None
     ) -> List["Node"]:
-
-        self.st = Node(st.snap(), st, 0, 0)
-        self.end = Node(end.snap(), end, 0, 0)
-        self.open = [self.st]
-        self.open_h = {}
-        self.open_h[st.snap().to_tuple()] = 0
-        self.closed = set()
-
-        logger.debug(f'Start search from {st} to {end}')
-
-        while self.open:
-            curr = heapq.heappop(self.open)
-            curr_tup = curr.pos.to_tuple()
-
-            if curr_tup in self.closed:
-                continue
-
-            self.closed.add(curr_tup)
-            self.open_h.pop(curr_tup)
-
-            # reached destination
-            if curr == self.end:
-                logger.debug(f'Found goal {end}')
-                return self._reconstruct(curr)
-
-            self._expand(curr)
-
-        logger.debug(f'Unable to reach {end} from {st}')
-        return []
+        '''The backward tree of `AStar.search_bidirectional()` is grown on the lattice, a hybrid search is
+        unidirectional'''
+        return self.search(st, end, epsilon, deadline)
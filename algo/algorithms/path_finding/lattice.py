@@ -0,0 +1,31 @@
+import numpy as np
+from typing import Tuple
+
+from common.consts import (
+    LATTICE_THETA,
+    LATTICE_X,
+    LATTICE_Y
+)
+
+
+class ClosedSet:
+    """
+    Dense closed set over the snapped (x, y, theta) search lattice.
+
+    Cells are (x, y, theta) lattice indices (see `Position.to_lattice`). Membership and insertion are O(1)
+    array lookups, and the memory footprint is fixed (LATTICE_X * LATTICE_Y * LATTICE_THETA bytes) regardless
+    of how many nodes are expanded. Cells outside of the lattice are never considered closed.
+    """
+
+    def __init__(self):
+        self.cells = np.zeros((LATTICE_X, LATTICE_Y, LATTICE_THETA), dtype=bool)
+
+    def add(self, k: Tuple[int, int, int]):
+        if 0 <= k[0] < LATTICE_X and 0 <= k[1] < LATTICE_Y:
+            self.cells[k] = True
+
+    def __contains__(self, k: Tuple[int, int, int]) -> bool:
+        return 0 <= k[0] < LATTICE_X and 0 <= k[1] < LATTICE_Y and bool(self.cells[k])
+
+    def __len__(self) -> int:
+        return int(self.cells.sum())
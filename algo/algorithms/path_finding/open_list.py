@@ -0,0 +1,82 @@
+import heapq
+from itertools import count
+from typing import Hashable, Optional
+
+
+class OpenList:
+    """
+    Priority queue of frontier nodes for the A* planners, with lazy decrease-key.
+
+    Every cell (identified by `key`) has at most one live entry. Pushing a cheaper node for a cell that
+    is already open invalidates the previous entry instead of searching for it in the heap; invalidated
+    entries are skipped (and counted in `stale_pops`) when they reach the top of the heap.
+
+    Entries of equal priority are popped by lowest `tie` first (e.g. the node's h, so that the search dives
+    towards the goal rather than widening the frontier), then in FIFO order.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.entries = {}  # key -> live [priority, tie, order, key, node] entry
+        self.order = count()  # FIFO tie-breaking between entries of equal priority and tie
+
+        self.pushes = 0
+        self.pops = 0
+        self.stale_pops = 0
+
+    def push(
+        self,
+        key: Hashable,
+        node,
+        priority: Optional[float] = None,
+        tie: float = 0
+    ) -> bool:
+        """Adds `node` as the open entry of `key` (prioritised by `node.f` unless `priority` is given, then by `tie`)
+
+        Returns:
+            False if `key` is already open with a priority that is at least as good, True otherwise.
+        """
+        if priority is None:
+            priority = node.f
+
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] <= priority:
+            return False
+
+        entry = [priority, tie, next(self.order), key, node]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+        self.pushes += 1
+        return True
+
+    def pop(self):
+        """Removes and returns the open node with the lowest priority, or None if the list is empty"""
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if self.entries.get(entry[3]) is not entry:
+                self.stale_pops += 1
+                continue
+
+            del self.entries[entry[3]]
+            self.pops += 1
+            return entry[4]
+        return None
+
+    def min_priority(self) -> float:
+        """Lowest priority of the open entries, inf if the list is empty"""
+        while self.heap and self.entries.get(self.heap[0][3]) is not self.heap[0]:
+            heapq.heappop(self.heap)
+            self.stale_pops += 1
+        return self.heap[0][0] if self.heap else float('inf')
+
+    def priority(self, key: Hashable) -> Optional[float]:
+        """Priority of the open entry of `key`, or None if `key` is not open"""
+        entry = self.entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
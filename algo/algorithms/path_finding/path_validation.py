@@ -43,11 +43,9 @@ def has_collision(
     v_u = calc_vector(st.theta - pi/2, 1)
     v_r = calc_vector(st.theta, 1)
 
-    for wp in wps:
-        pos = Position(*(v_st + wp[0]*v_u + wp[1]*v_r),
-                       ((st.theta + wp[2]) % (2*pi)))
-        if not mp.is_valid(pos, obs):
-            # print(f"Collision at {pos} for {movement}")
-            return True
-        # print(f"No collision at {pos} for {movement}")
-    return False
+    # Check every waypoint of the turn in a single call
+    poses = np.array([
+        [*(v_st + wp[0]*v_u + wp[1]*v_r), (st.theta + wp[2]) % (2*pi)]
+        for wp in wps
+    ])
+    return not mp.is_valid_batch(poses, obs).all()
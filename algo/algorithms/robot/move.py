@@ -1,17 +1,85 @@
 from math import pi
+import numpy as np
 from common.consts import (
     DIST_BL,
     DIST_BR,
     DIST_BW,
     DIST_FL,
     DIST_FR,
-    DIST_FW
+    DIST_FW,
+    LATTICE_THETA,
+    SNAP_THETA
 )
+from common.enums import Movement
 from common.utils import calc_vector
 from common.types import Position
 
 
 D_THETA = pi/2
+D_HEADING = 45 // SNAP_THETA  # heading change of a 45-degree turn, in lattice heading indices
+assert D_HEADING * SNAP_THETA == 45, "SNAP_THETA must divide the 45-degree turns"
+
+# The robot's motion primitives, in the order used by the planners (the index is the primitive's motion code):
+# (v, s, d, Movement, displacement to the right, displacement to the front, heading change in lattice indices)
+# See `Node` in `path_finding/astar.py` for the definitions of v, s and d.
+MOTIONS = (
+    (1,  0, DIST_FW,    Movement.FWD,       0,          DIST_FW,    0),            # straight forward
+    (1, -1, DIST_FL[2], Movement.FWD_LEFT,  DIST_FL[0], DIST_FL[1], D_HEADING),    # 45-degree left turn
+    (1,  1, DIST_FR[2], Movement.FWD_RIGHT, DIST_FR[0], DIST_FR[1], -D_HEADING),   # 45-degree right turn
+    (-1,  0, DIST_BW,    Movement.BWD,       0,          -DIST_BW,   0),           # straight backward
+    (-1, -1, DIST_BL[2], Movement.BWD_LEFT,  DIST_BL[0], DIST_BL[1], -D_HEADING),  # 45-degree left turn
+    (-1,  1, DIST_BR[2], Movement.BWD_RIGHT, DIST_BR[0], DIST_BR[1], D_HEADING),   # 45-degree right turn
+)
+
+
+def heading_to_theta(heading: int) -> float:
+    """Direction (in radians) of a lattice heading index"""
+    return heading * SNAP_THETA / 180 * pi
+
+
+def build_primitive_table(motions=MOTIONS):
+    """Tabulates the world-frame result of every motion primitive for every lattice heading
+
+    Returns:
+        dx, dy: (LATTICE_THETA, len(motions)) float arrays of the robot's displacement
+        heading: (LATTICE_THETA, len(motions)) int array of the lattice heading after the move
+    """
+    theta = heading_to_theta(np.arange(LATTICE_THETA))[:, None]
+    right = np.array([m[4] for m in motions], dtype=float)[None, :]
+    front = np.array([m[5] for m in motions], dtype=float)[None, :]
+    turn = np.array([m[6] for m in motions], dtype=int)[None, :]
+
+    # right of the robot is (sin, -cos), front is (cos, sin)
+    dx = right * np.sin(theta) + front * np.cos(theta)
+    dy = -right * np.cos(theta) + front * np.sin(theta)
+    heading = (np.arange(LATTICE_THETA)[:, None] + turn) % LATTICE_THETA
+    return dx, dy, heading
+
+
+# Built once at import for the calibration profile selected in `common/consts.py`
+PRIMITIVE_DX, PRIMITIVE_DY, PRIMITIVE_HEADING = build_primitive_table()
+
+# PRIMITIVES[heading] -> ((motion code, v, s, d, Movement, dx, dy, new heading), ...) for fast successor generation
+PRIMITIVES = tuple(
+    tuple(
+        (k, v, s, d, mv, float(PRIMITIVE_DX[h, k]), float(PRIMITIVE_DY[h, k]), int(PRIMITIVE_HEADING[h, k]))
+        for k, (v, s, d, mv, *_) in enumerate(MOTIONS)
+    )
+    for h in range(LATTICE_THETA)
+)
+
+# REVERSED_PRIMITIVES[heading] -> ((motion code, v, s, d, Movement, dx, dy, previous heading), ...): every move that ends
+# at `heading`, with the displacement that leads back to where it starts (undoing a forward move is driving the same
+# arc backward, and conversely). Used to grow search trees backward from the goal.
+REVERSED_PRIMITIVES = tuple(
+    tuple(
+        (k, v, s, d, mv, -float(PRIMITIVE_DX[prev, k]), -float(PRIMITIVE_DY[prev, k]), int(prev))
+        for k, (v, s, d, mv, *_), prev in (
+            (k, motion, (h - motion[6]) % LATTICE_THETA) for k, motion in enumerate(MOTIONS)
+        )
+    )
+    for h in range(LATTICE_THETA)
+)
 
 
 def fwd(pos: "Position") -> "Position":
@@ -0,0 +1,28 @@
+import math
+import os
+import random
+import sys
+
+import pytest
+
+# The modules import each other from the root of `algorithms` (e.g. `from arena.map import Map`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from arena.obstacle import Obstacle  # noqa: E402
+from common.enums import Direction  # noqa: E402
+from common.types import Position  # noqa: E402
+
+
+def random_obstacles(rng: random.Random, n: int = 5) -> list:
+    """`n` obstacles at least 30cm apart, away from the start corner"""
+    obstacles = []
+    while len(obstacles) < n:
+        x, y = rng.randrange(2, 18) * 10, rng.randrange(2, 18) * 10
+        if all(abs(x - o.x) >= 30 or abs(y - o.y) >= 30 for o in obstacles) and (x > 50 or y > 50):
+            obstacles.append(Obstacle(x, y, rng.choice(list(Direction))))
+    return obstacles
+
+
+@pytest.fixture
+def start() -> Position:
+    return Position(0, 0, math.pi / 2)
@@ -0,0 +1,96 @@
+import math
+import random
+
+import pytest
+
+from arena.map import Map
+from arena.obstacle import Obstacle
+from common.enums import Direction
+from common.consts import LATTICE_X
+from common.types import Position
+from common.utils import euclidean
+from path_finding.astar import _MOTION_CODES, AStar, Goal
+from path_finding.heuristics import cost_to_go
+from path_finding.path_validation import has_collision
+from robot.move import MOTIONS
+
+from conftest import random_obstacles
+
+
+def _collisions(path, mp):
+    """Moves of a path that collide from the exact pose they start from"""
+    return [
+        (prev.c_pos, MOTIONS[_MOTION_CODES[node.v, node.s]][3]) for prev, node in zip(path, path[1:])
+        if has_collision(prev.c_pos, MOTIONS[_MOTION_CODES[node.v, node.s]][3], mp)
+    ]
+
+
+@pytest.mark.parametrize("seed", [0, 9])
+def test_paths_replay_without_collision(seed, start):
+    mp = Map(random_obstacles(random.Random(seed)))
+    astar = AStar(mp)
+    ends = [o.to_pos() for o in mp.obstacles]
+
+    found = 0
+    for st in [start] + ends:
+        for end in ends:
+            if end is st:
+                continue
+            path = astar.search(st, end)
+            found += bool(path)
+            assert _collisions(path, mp) == []
+    assert found
+
+
+@pytest.mark.parametrize("epsilon", [1.5, 3])
+def test_weighted_search_reaches_what_unweighted_does(epsilon, start):
+    # a layout on which a weighted sweep misses legs that an unweighted one finds
+    mp = Map(random_obstacles(random.Random(15)))
+    astar = AStar(mp)
+    locations = [start] + [o.to_pos() for o in mp.obstacles]
+    for st in locations:
+        for end in locations[1:]:
+            if end is st:
+                continue
+            best = astar.search(st, end)
+            if best:
+                path = astar.search(st, end, epsilon)
+                assert path
+                assert path[-1].g <= epsilon * best[-1].g + 1e-6
+
+
+def test_heuristic_off_the_lattice_falls_back_to_the_obstacle_free_bounds():
+    astar = AStar(Map([Obstacle(170, 170, Direction.SOUTH)]))
+    goal = astar._goal(Position(20, 100, math.pi / 2))
+    # a pose that snaps to the column left of the lattice, whose index would wrap to the far (right) side of it
+    pos, k = Position(-3, 100, math.pi / 2), (-1, 20, 6)
+
+    assert goal.h(pos, k) == max(euclidean(pos, goal.end), cost_to_go(-3, 100, 6, 20, 100, goal.heading))
+    assert goal.h(pos, k) < goal.field[LATTICE_X - 1, 20, 6]
+
+
+def test_field_heuristic_keeps_plan_quality(start, monkeypatch):
+    # the search keeps one pose per cell, so that the heuristic decides which legs it finds: the obstacle-aware one
+    # misses a leg that the euclidean distance alone finds on these layouts (seed 3, to location 2), but it is not
+    # costlier over the legs that both find
+    legs = [(seed, i) for seed in (0, 3, 4) for i in range(5)]
+    layouts = {seed: Map(random_obstacles(random.Random(seed))) for seed in (0, 3, 4)}
+
+    def costs():
+        found = {}
+        for seed, mp in layouts.items():
+            astar = AStar(mp)
+            for i, o in enumerate(mp.obstacles):
+                path = astar.search(start, o.to_pos())
+                if path:
+                    found[seed, i] = path[-1].g
+        return found
+
+    field = costs()
+    monkeypatch.setattr(Goal, 'h', lambda self, pos, k: euclidean(pos, self.end))
+    plain = costs()
+
+    assert len([leg for leg in legs if leg in plain and leg not in field]) <= 1
+    both = [leg for leg in legs if leg in plain and leg in field]
+    assert both
+    assert sum(field[leg] for leg in both) <= sum(plain[leg] for leg in both) + 1e-6
@@ -0,0 +1,20 @@
+import numpy as np
+
+from path_finding.dubins_path import SEGMENTS, advance, dubins_batch
+
+
+def test_dubins_batch_ends_on_the_target_pose():
+    rng = np.random.default_rng(0)
+    st = np.column_stack([rng.uniform(0, 200, 500), rng.uniform(0, 200, 500), rng.uniform(-np.pi, np.pi, 500)])
+    end = np.column_stack([rng.uniform(0, 200, 500), rng.uniform(0, 200, 500), rng.uniform(-np.pi, np.pi, 500)])
+
+    sol = dubins_batch(st, end)
+    reached = advance(sol.pt2, SEGMENTS[None, :, 2], sol.lengths[..., 2])
+
+    solved = np.isfinite(sol.total)
+    assert solved[:, [0, 3]].all()  # LSL and RSR always exist
+    target = np.broadcast_to(end[:, None, :], reached.shape)
+    assert np.allclose(reached[solved][:, :2], target[solved][:, :2], atol=1e-6)
+    dtheta = np.angle(np.exp(1j * (reached[solved][:, 2] - target[solved][:, 2])))
+    assert np.allclose(dtheta, 0, atol=1e-6)
+    assert np.allclose(sol.shortest, sol.total.min(axis=1))
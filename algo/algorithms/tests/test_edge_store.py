@@ -0,0 +1,66 @@
+import math
+import random
+
+from arena.map import Map
+from arena.obstacle import Obstacle
+from common.enums import Direction
+from path_finding.astar import AStar
+from path_finding.edge_store import MOVE_REACH, POSE_SLACK, EdgeStore
+from path_finding.path_validation import has_collision
+from robot.move import MOTIONS
+
+from conftest import random_obstacles
+
+
+def _blocks(obstacle, path, obstacles) -> bool:
+    mp = Map(obstacles + [obstacle])
+    return any(
+        has_collision(prev.c_pos, MOTIONS[code][3], mp) for prev, code in zip(path, AStar.compact(path)[1])
+    )
+
+
+def test_blocking_obstacle_invalidates_edge(tmp_path, start):
+    obstacles = random_obstacles(random.Random(0))
+    astar = AStar(Map(obstacles))
+    end, path = next(
+        (end, path) for end in (o.to_pos() for o in obstacles) for path in [astar.search(start, end)] if path
+    )
+
+    store = EdgeStore(str(tmp_path / 'edges.sqlite'))
+    store.put_many(astar.map, 'Exhaustive Astar', 1, start, [(end, path[-1].f, astar.compact(path))])
+    cost, (cells, codes) = store.get(astar, 'Exhaustive Astar', 1, start, end)
+    assert cost == path[-1].f
+    assert codes.tolist() == astar.compact(path)[1].tolist()
+
+    # an obstacle on the stored path, away from the other obstacles
+    blocking = next(
+        Obstacle(x, y, Direction.NORTH)
+        for node in path[len(path) // 2:] + path[:len(path) // 2]
+        for x, y in [(int(node.c_pos.x // 10 * 10), int(node.c_pos.y // 10 * 10))]
+        if all(abs(x - o.x) >= 20 or abs(y - o.y) >= 20 for o in obstacles)
+        and _blocks(Obstacle(x, y, Direction.NORTH), path, obstacles)
+    )
+    assert store.get(AStar(Map(obstacles + [blocking])), 'Exhaustive Astar', 1, start, end) is None
+    # the entry still holds on its own layout, for larger weights, and only in its direction
+    assert store.get(AStar(Map(obstacles)), 'Exhaustive Astar', 2, start, end) is not None
+    assert store.get(AStar(Map(obstacles)), 'Exhaustive Astar', 1, end, start) is None
+
+
+def test_layouts_share_the_edges_away_from_their_differences(tmp_path, start):
+    obstacles = random_obstacles(random.Random(0))
+    astar = AStar(Map(obstacles))
+    end, path = next(
+        (end, path) for end in (o.to_pos() for o in obstacles) for path in [astar.search(start, end)] if path
+    )
+    store = EdgeStore(str(tmp_path / 'edges.sqlite'))
+    store.put_many(astar.map, 'Exhaustive Astar', 1, start, [(end, path[-1].f, astar.compact(path))])
+
+    # another layout: an obstacle out of reach of every pose of the path
+    away = next(
+        Obstacle(x, y, Direction.NORTH)
+        for x in range(10, 200, 10) for y in range(10, 200, 10)
+        if all(abs(x - o.x) >= 30 or abs(y - o.y) >= 30 for o in obstacles)
+        and all(math.hypot(x + 5 - node.c_pos.x, y + 5 - node.c_pos.y) > MOVE_REACH + 2 * POSE_SLACK for node in path)
+    )
+    found = store.get(AStar(Map(obstacles + [away])), 'Exhaustive Astar', 1, start, end)
+    assert found is not None and found[0] == path[-1].f
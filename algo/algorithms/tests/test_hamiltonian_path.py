@@ -0,0 +1,73 @@
+import itertools
+import random
+import time
+
+import pytest
+
+from arena.map import Map
+from path_finding.astar import AStar, Node
+from path_finding.hamiltonian_path import ANYTIME_EPSILONS, AlgoType, HamiltonianSearch, SearchPool, held_karp
+
+from conftest import random_obstacles
+
+
+@pytest.mark.parametrize("n, k", [(1, 1), (2, 3), (5, 1), (6, 4)])
+def test_held_karp_matches_brute_force(n, k):
+    rng = random.Random(n * 10 + k)
+    edges = [[rng.uniform(1, 100) for _ in range(n)] for _ in range(n)]
+    orders = sorted(
+        (sum(edges[a][b] for a, b in zip(perm, perm[1:])), perm)
+        for perm in ([0, *rest] for rest in itertools.permutations(range(1, n)))
+    )[:k]
+
+    found = held_karp(edges, k)
+
+    assert [perm for _, perm in found] == [perm for _, perm in orders]
+    assert [cost for cost, _ in found] == pytest.approx([cost for cost, _ in orders])
+
+
+def test_failed_legs_are_dropped(start):
+    algo = HamiltonianSearch(Map(random_obstacles(random.Random(0))), start, AlgoType.DUBINS)
+    failing = 2
+
+    def leg(st, r, c, epsilon=1, deadline=None):
+        end = algo.pos[c]
+        return [] if c == failing else [Node(end.snap(), end, 10, 0)]
+    algo._leg = leg
+
+    min_perm, paths = algo.search()
+
+    assert failing in algo.dropped
+    assert failing not in min_perm
+    assert sorted(min_perm + algo.dropped) == list(range(len(algo.pos)))
+    # every path is the leg to the location it is zipped with
+    assert len(paths) == len(min_perm) - 1
+    for path, loc in zip(paths, min_perm[1:]):
+        assert path[-1].c_pos is algo.pos[loc]
+
+
+def test_layout_is_sent_once_for_every_pass(start):
+    with SearchPool(1) as pool:
+        sent = []
+        put = pool.inboxes[0].put
+        pool.inboxes[0].put = lambda msg: (sent.append(msg and msg[0]), put(msg))
+        algo = HamiltonianSearch(Map(random_obstacles(random.Random(0), 2)), start, AlgoType.EXHAUSTIVE_ASTAR,
+                                 pool=pool, deadline=time.time() + 300)
+        algo.search()
+
+    assert algo.bound == 1
+    assert sent.count('layout') == 1 and sent.count('drop') == 1
+    assert sent.count('row') == len(ANYTIME_EPSILONS) * (len(algo.pos) - len(algo.dropped))
+
+
+def test_reachable_goals_are_kept(start):
+    # the viewing pose of location 3 (165, 50) is out of the arena, but some poses of its goal region are not
+    mp = Map(random_obstacles(random.Random(10)))
+    algo = HamiltonianSearch(mp, start, AlgoType.EXHAUSTIVE_ASTAR, n=1)
+
+    min_perm, _ = algo.search()
+
+    assert 3 in min_perm
+    astar = AStar(mp)
+    for loc in algo.dropped:
+        assert not any(astar.search(algo.pos[r], algo.pos[loc]) for r in range(len(algo.pos)) if r != loc)
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import main
+from main import AlgoInput, AlgoInputMode, Job, Planner
+from path_finding.hamiltonian_path import AlgoType, SearchCancelled
+
+# live mode, 10cm grid: the last obstacle faces the wall, it cannot be viewed
+OBSTACLES = [
+    {"id": 11, "x": 5, "y": 10, "d": 3},
+    {"id": 12, "x": 10, "y": 15, "d": 2},
+    {"id": 13, "x": 15, "y": 6, "d": 1},
+    {"id": 14, "x": 0, "y": 10, "d": 4},
+]
+
+
+def _request(obstacles, **kwargs) -> AlgoInput:
+    return AlgoInput(value={"obstacles": obstacles}, server_mode=AlgoInputMode.LIVE, algo_type=AlgoType.DUBINS,
+                     **kwargs)
+
+
+@pytest.fixture
+def planner():
+    planner = Planner(workers=1)
+    yield planner
+    planner.close()
+
+
+def _snapped(result, obstacles) -> list:
+    """The obstacles of the SNAP commands of a plan, by position"""
+    return [
+        (obstacles[int(c.value[4:]) - 1]["x"], obstacles[int(c.value[4:]) - 1]["y"])
+        for c in result["commands"] if c.value.startswith("SNAP")
+    ]
+
+
+def test_cached_plan_is_mapped_to_the_request(planner):
+    first = planner._plan(_request(OBSTACLES).model_dump(), received=time.time())
+    # the same layout, in another order and with other ids
+    shuffled = [{**o, "id": o["id"] + 10} for o in (OBSTACLES[2], OBSTACLES[3], OBSTACLES[0], OBSTACLES[1])]
+    second = planner._plan(_request(shuffled).model_dump(), received=time.time())
+
+    assert not first["cache_hit"] and second["cache_hit"]
+    assert _snapped(first, OBSTACLES) and _snapped(second, shuffled) == _snapped(first, OBSTACLES)
+    assert first["dropped_obstacles"] == [14] and second["dropped_obstacles"] == [24]
+
+
+def test_every_algo_type_is_served():
+    for algo_type in AlgoType:
+        assert AlgoInput.model_validate({"value": {"obstacles": OBSTACLES}, "algo_type": algo_type.value}).algo_type \
+            == algo_type
+
+
+def test_queued_job_is_cancelled(planner):
+    gate = threading.Event()
+    planner.executor.submit(gate.wait)  # keeps the only planning thread busy
+    job = Job(_request(OBSTACLES).model_dump())
+    job.start(planner, None)
+    assert job.output()["status"] == "queued"
+
+    job.cancel()
+    gate.set()
+
+    assert job.output()["status"] == "cancelled"
+    assert job.search is None
+
+
+def test_running_job_is_cancelled(planner):
+    job = Job(_request(OBSTACLES).model_dump())
+    started, resume = threading.Event(), threading.Event()
+
+    def on_start(search):
+        Job._started(job, search)
+        started.set()
+        resume.wait()
+    job._started = on_start
+    job.start(planner, None)
+    assert started.wait(30)
+    assert job.output()["status"] == "running"
+
+    job.cancel()
+    resume.set()
+
+    with pytest.raises(SearchCancelled):
+        job.future.result(30)
+    assert job.output()["status"] == "cancelled"
+
+
+def test_stream_frames(planner):
+    main.app.state.planner, main.app.state.pool = planner, None
+
+    async def read():
+        response = await main.algo_live_stream(_request(OBSTACLES[:3]))
+        return "".join([chunk async for chunk in response.body_iterator])
+
+    frames = asyncio.run(read()).split("\n\n")
+
+    assert frames.pop() == ""
+    events = []
+    for frame in frames:
+        event, data = frame.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    assert [event for event, _ in events] == ["commands"] * 3 + ["done"]
+    for _, batch in events[:-1]:
+        assert batch["commands"][-1]["value"].startswith("SNAP")
+    assert [c["value"] for c in events[-1][1]["commands"]] == ["FIN"]
+
+
+@pytest.mark.parametrize("obstacles, dropped", [([], []), (OBSTACLES[3:], [14])])
+def test_empty_tour(planner, obstacles, dropped):
+    main.app.state.planner, main.app.state.pool = planner, None
+
+    live = asyncio.run(main.algo_live(_request(obstacles)))
+    simulator = asyncio.run(main.algo_simulator(_request(obstacles).model_copy(
+        update={"server_mode": AlgoInputMode.SIMULATOR})))
+
+    assert [c.value for c in live["commands"]] == ["FIN"]
+    assert live["commands"][0].end_position.model_dump() == {"x": 0, "y": 0, "d": "N"}
+    assert simulator["positions"] == []
+    assert live["dropped_obstacles"] == simulator["dropped_obstacles"] == dropped
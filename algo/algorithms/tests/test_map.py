@@ -0,0 +1,81 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from arena.map import Map
+from common.consts import EDGE_ERR, MAP_HEIGHT, MAP_WIDTH, OBSTACLE_WIDTH, ROBOT_HEIGHT, ROBOT_WIDTH
+from common.types import Position
+
+from conftest import random_obstacles
+
+
+def _is_valid(pos: Position, obstacles) -> bool:
+    """Pose-by-pose reference: the robot's corners in the Map, and no corner of either footprint inside the other
+    and no crossing edges"""
+    origin = np.array([pos.x, pos.y])
+    up = (ROBOT_HEIGHT + 8) * np.array([math.cos(pos.theta), math.sin(pos.theta)])
+    right = (ROBOT_WIDTH + 8) * np.array([math.cos(pos.theta - math.pi / 2), math.sin(pos.theta - math.pi / 2)])
+    robot = [origin, origin + right, origin + right + up, origin + up]
+    if not all(-EDGE_ERR <= x <= MAP_WIDTH + EDGE_ERR and -EDGE_ERR <= y <= MAP_HEIGHT + EDGE_ERR for x, y in robot):
+        return False
+
+    def inside_robot(p):
+        v = p - origin
+        return 0 <= v @ up / (up @ up) <= 1 and 0 <= v @ right / (right @ right) <= 1
+
+    def cross(a, b, c, d):
+        ccw = lambda p, q, r: (r[1] - p[1]) * (q[0] - p[0]) > (q[1] - p[1]) * (r[0] - p[0])  # noqa: E731
+        return ccw(a, c, d) != ccw(b, c, d) and ccw(a, b, c) != ccw(a, b, d)
+
+    for o in obstacles:
+        lo, hi = EDGE_ERR - 15, OBSTACLE_WIDTH - EDGE_ERR + 15
+        box = [np.array([o.x + dx, o.y + dy]) for dx, dy in ((lo, lo), (hi, lo), (hi, hi), (lo, hi))]
+        if any(o.x + lo <= x <= o.x + hi and o.y + lo <= y <= o.y + hi for x, y in robot):
+            return False
+        if any(inside_robot(p) for p in box):
+            return False
+        if any(cross(robot[i], robot[i - 1], box[j], box[j - 1]) for i in range(4) for j in range(4)):
+            return False
+    return True
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_is_valid_batch_agrees_with_reference(seed):
+    rng = random.Random(seed)
+    mp = Map(random_obstacles(rng))
+    poses = [Position(rng.uniform(-20, 220), rng.uniform(-20, 220), rng.uniform(-math.pi, math.pi))
+             for _ in range(2000)]
+
+    valid = mp.is_valid_batch(np.array([[p.x, p.y, p.theta] for p in poses]))
+
+    assert valid.tolist() == [_is_valid(p, mp.obstacles) for p in poses]
+    assert valid.tolist() == [mp.is_valid(p) for p in poses]
+    assert 0 < valid.sum() < len(poses)
+
+
+def test_is_valid_batch_checks_the_masked_obstacles():
+    rng = random.Random(3)
+    mp = Map(random_obstacles(rng))
+    poses = np.array([[rng.uniform(0, 200), rng.uniform(0, 200), rng.uniform(-math.pi, math.pi)] for _ in range(500)])
+    checked = np.array([[rng.random() < 0.5 for _ in mp.obstacles] for _ in poses])
+
+    valid = mp.is_valid_batch(poses, checked=checked)
+
+    assert valid.tolist() == [
+        mp.is_valid(Position(*pose), [o for o, c in zip(mp.obstacles, mask) if c]) for pose, mask in zip(poses, checked)
+    ]
+
+
+def test_priority_obs_matches_a_linear_scan():
+    rng = random.Random(4)
+    mp = Map(random_obstacles(rng, 10))
+    for _ in range(500):
+        pos = Position(rng.uniform(0, 200), rng.uniform(0, 200), rng.choice([rng.uniform(-math.pi, math.pi), math.pi]))
+        for move in Map.bounds:
+            x_lo, x_hi, y_lo, y_hi = Map._boxes(pos.theta)[move]
+            assert set(map(id, mp.priority_obs(pos, move))) == {
+                id(o) for o in mp.obstacles
+                if pos.x + x_lo < o.middle[0] < pos.x + x_hi and pos.y + y_lo < o.middle[1] < pos.y + y_hi
+            }